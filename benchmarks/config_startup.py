@@ -0,0 +1,71 @@
+"""Compares a cold start, which reads every guild config from the database, with a warm start from the snapshot.
+
+    python3 -m benchmarks.config_startup [guilds]
+
+With DATABASE_URL set the cold start runs ConfigDatabase.load_all against that database, otherwise it only times
+decoding the same number of synthetic rows, which is a lower bound that leaves out the query itself.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from os import environ
+
+from glyph.guildconfig import GuildConfig
+from glyph.serverconfig import ConfigDatabase
+from glyph.snapshot import ConfigSnapshot
+
+
+def synthetic_rows(guilds):
+    for guild_id in range(guilds):
+        yield {"guild_id": guild_id, "wiki": "wiki{}".format(guild_id % 50),
+               "selectable_roles": ["Role {}".format(role) for role in range(guild_id % 8)],
+               "spoilers_channel": str(guild_id), "spoilers_keywords": ["spoiler", "ending {}".format(guild_id)],
+               "fa_quickview_enabled": True, "fa_quickview_thumbnail": guild_id % 2 == 0,
+               "picarto_quickview_enabled": True, "auditing_channel": None, "auditing_joins": False,
+               "auditing_leaves": False, "auditing_reactions": guild_id % 3 == 0, "updated_at": time.time()}
+
+
+def cold(guilds):
+    if environ.get("DATABASE_URL"):
+        database = ConfigDatabase(environ.get("DATABASE_URL"))
+        start = time.perf_counter()
+        asyncio.get_event_loop().run_until_complete(database.load_all())
+        elapsed = time.perf_counter() - start
+        database.close()
+        return elapsed, len(database.configs)
+    rows = list(synthetic_rows(guilds))
+    start = time.perf_counter()
+    configs = {row["guild_id"]: GuildConfig.from_row(row) for row in rows}
+    return time.perf_counter() - start, len(configs)
+
+
+def warm(path, lookups):
+    start = time.perf_counter()
+    snapshot = ConfigSnapshot.open(path)
+    for guild_id in range(lookups):
+        snapshot.get(guild_id)
+    elapsed = time.perf_counter() - start
+    count = snapshot.count
+    snapshot.close()
+    return elapsed, count
+
+
+def main():
+    guilds = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    lookups = 100  # The default config and the busiest guilds prefetched on startup
+    path = os.path.join(tempfile.mkdtemp(), "configs.snapshot")
+    ConfigSnapshot.write(path, [(row["guild_id"], row["updated_at"], ConfigSnapshot.encode(GuildConfig.from_row(row)))
+                                for row in synthetic_rows(guilds)], time.time())
+
+    cold_time, cold_count = cold(guilds)
+    warm_time, warm_count = warm(path, lookups)
+    print("Snapshot: {} guilds, {:.1f} KiB".format(warm_count, os.path.getsize(path) / 1024))
+    print("Cold start: {:8.2f} ms for {} configs".format(cold_time * 1000, cold_count))
+    print("Warm start: {:8.2f} ms to open the snapshot and read {} configs".format(warm_time * 1000, lookups))
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,153 @@
 import json
+import logging
+import re
+import time
+from collections import OrderedDict
 
-import apiai
+from . import web
+from .resilience import CircuitBreaker
+
+log = logging.getLogger(__name__)
+
+
+class AIUnavailable(Exception):
+    """Raised when api.ai can't answer a query in time, or isn't asked because it is failing."""
+
+
+class ResponseCache(object):
+    """A TTL and size bounded cache of api.ai responses, keyed by normalized query text.
+
+    Only responses that don't depend on the session are kept, that is those without contexts or a pending follow up.
+    Entries expire by wall clock time, so when a path is given the cache can be saved and loaded across restarts.
+    """
+
+    __slots__ = ["ttl", "max_entries", "path", "entries", "stats"]
+
+    def __init__(self, *, ttl=3600, max_entries=5000, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()  # Normalized query to (expires, response) in least recently used order
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(re.sub(r"[^\w\s/+@-]", "", query.lower()).split())
+
+    @staticmethod
+    def cacheable(response):
+        result = response.get("result", {})
+        succeeded = response.get("status", {}).get("code", 200) == 200
+        return succeeded and not result.get("contexts") and not result.get("actionIncomplete")
+
+    def get(self, query, *, now=None):
+        key = self.normalize(query)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > (now or time.time()):
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+        if entry is not None:
+            del self.entries[key]
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, query, response, *, now=None):
+        if not self.cacheable(response):
+            return
+        key = self.normalize(query)
+        self.entries.pop(key, None)
+        self.entries[key] = ((now or time.time()) + self.ttl, response)
+        self.stats["stores"] += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, expires, response in entries:
+            if expires > now:
+                self.entries[key] = (expires, response)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "w") as file:
+                json.dump([[key, expires, response] for key, (expires, response) in self.entries.items()], file)
+        except OSError as e:
+            log.warning("Failed to save the api.ai response cache: {}".format(e))
 
 
 class AIProcessor(object):
+    """An async client of api.ai's query endpoint.
+
+    Every query has a deadline, and at most max_pending queries are in flight at once, further ones fail right away
+    instead of queueing behind a slow upstream. A circuit breaker stops querying after repeated failures or slow
+    responses. In all of these cases AIUnavailable is raised, so the caller can degrade quickly.
+    """
+
+    __slots__ = ["client_access_token", "cache", "timeout", "max_pending", "breaker", "pending"]
 
-    def __init__(self, client_access_token):
-        self.apiai = apiai.ApiAI(client_access_token)
+    url = "https://api.api.ai/v1/query?v=20150910"
 
-    def query(self, query, session_id):
-        request = self.apiai.text_request()
-        request.session_id = session_id
-        request.query = query
-        response = request.getresponse()
-        data = response.read().decode("utf-8")
-        return AIResponse(json.loads(data))
+    def __init__(self, client_access_token, *, cache=None, timeout=3, max_pending=20, breaker=None):
+        self.client_access_token = client_access_token
+        self.cache = cache
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.breaker = breaker or CircuitBreaker(failure_threshold=5, latency_limit=timeout / 2, reset_timeout=30)
+        self.pending = 0
+
+    async def query(self, query, session_id):
+        if self.cache is not None:
+            cached = self.cache.get(query)
+            if cached is not None:
+                return AIResponse(cached)
+        if self.pending >= self.max_pending:
+            raise AIUnavailable("Too many pending api.ai queries")
+        if not self.breaker.allow():
+            raise AIUnavailable("api.ai is failing, not querying it for now")
+        self.pending += 1
+        start = time.monotonic()
+        try:
+            status, text = await web.client.post(
+                self.url, json_data={"query": query, "lang": "en", "sessionId": str(session_id)},
+                headers={"Authorization": "Bearer {}".format(self.client_access_token)}, timeout=self.timeout)
+            if status != 200:
+                raise web.WebError("api.ai returned {}".format(status), status=status)
+            data = json.loads(text)
+            response = AIResponse(data)  # Malformed responses count as failures too
+        except (web.WebError, ValueError, KeyError, TypeError, AttributeError) as e:
+            self.breaker.failure()
+            raise AIUnavailable(str(e)) from e
+        except BaseException:
+            self.breaker.failure()  # Cancelled, so a trial call is never left unanswered
+            raise
+        finally:
+            self.pending -= 1
+        self.breaker.success(time.monotonic() - start)
+        if self.cache is not None:
+            self.cache.put(query, data)
+        return response
 
 
 class AIResponse(object):
@@ -1,45 +1,105 @@
+import asyncio
 from datetime import datetime
 
 import discord
 import humanize
 
+from .orchestrators import dispatch
+
 
 class AuditType(object):
 
-    def __init__(self, message, color):
+    def __init__(self, message, color, digest=None):
         self.title = message
         self.color = color
+        self.digest = digest or "{} events of " + message
 
 
-MEMBER_JOIN = AuditType("Member Joined", 0x41E254)
-MEMBER_LEAVE = AuditType("Member Left", 0xBA3737)
-MESSAGE_DELETE = AuditType("Message Deleted", 0xBA3737)
-REACTION_ADD = AuditType("Reaction Added", 0x41E254)
-REACTION_REMOVE = AuditType("Reaction Removed", 0xBA3737)
+MEMBER_JOIN = AuditType("Member Joined", 0x41E254, "{} members joined in {}s")
+MEMBER_LEAVE = AuditType("Member Left", 0xBA3737, "{} members left in {}s")
+MESSAGE_DELETE = AuditType("Message Deleted", 0xBA3737, "{} messages deleted in {}s")
+REACTION_ADD = AuditType("Reaction Added", 0x41E254, "{} reactions added in {}s")
+REACTION_REMOVE = AuditType("Reaction Removed", 0xBA3737, "{} reactions removed in {}s")
 STATUS = AuditType("Bot Status", 0x929392)
 
 
 class Auditor(object):
 
-    def __init__(self, client):
+    def __init__(self, client, *, digest_interval=10, digest_threshold=3, store=None):
         if not isinstance(client, discord.Client):
             raise ValueError("client must be an instance of class discord.Client")
         self.bot = client
+        self.digest_interval = digest_interval
+        self.digest_threshold = digest_threshold
+        self.windows = {}
+        self.channels = {}
+        self.store = store
+
+    def route(self, server, config):
+        """Returns the audit channel of a server, caching it per server until its name or the channels change."""
+        if server is None:
+            return None
+        name = config.auditing_channel
+        cached = self.channels.get(server.id)
+        if cached is not None and cached[0] == name:
+            return cached[1]
+        log_channel = discord.utils.get(server.channels, name=name) if name else None
+        self.channels[server.id] = (name, log_channel)
+        return log_channel
+
+    def invalidate(self, server):
+        self.channels.pop(server.id, None)
 
-    async def audit(self, server, audit_type, message, *, user):
+    async def audit(self, server, audit_type, message, *, user, config=None):
         if not isinstance(server, discord.Server):
             raise ValueError("server must be an instance of class discord.Server")
         if not isinstance(audit_type, AuditType):
             raise ValueError("type must be an instance of class auditing.AuditType")
-        config = self.bot.configdb.get(server)
-        log_channel = discord.utils.get(server.channels, name=config["auditing"]["channel"])
-        if log_channel is not None:
-            embed = discord.Embed(title=audit_type.title, description=message,
-                                  color=audit_type.color, timestamp=datetime.utcnow())
-            embed.set_footer(text="Auditing")
-            if user is not None:
-                embed.set_thumbnail(url=user.avatar_url)
-            await self.bot.messaging.send(log_channel, embed=embed)
+        if config is None:
+            config = self.bot.configdb.get(server)
+        log_channel = self.route(server, config)
+        if log_channel is None:
+            return
+        if self.store is not None:
+            self.store.record(server.id, audit_type.title, None if user is None else user.id, message)
+        # Bursts are buffered per server and type, the first event of a burst is still audited right away
+        key = (server.id, audit_type.title)
+        events = self.windows.get(key)
+        if events is not None:
+            events.append((message, user))
+            return
+        self.windows[key] = []
+        self.bot.loop.create_task(self._digest(key, log_channel, audit_type))
+        await self._send(log_channel, audit_type, message, user)
+
+    async def _send(self, log_channel, audit_type, message, user):
+        embed = discord.Embed(title=audit_type.title, description=message,
+                              color=audit_type.color, timestamp=datetime.utcnow())
+        embed.set_footer(text="Auditing")
+        if user is not None:
+            embed.set_thumbnail(url=user.avatar_url)
+        await self.bot.messaging.send(log_channel, embed=embed, priority=dispatch.AUDIT, coalesce=True)
+
+    async def _digest(self, key, log_channel, audit_type):
+        try:
+            while True:
+                await asyncio.sleep(self.digest_interval)
+                events = self.windows[key]
+                if not events:
+                    break
+                self.windows[key] = []
+                if len(events) < self.digest_threshold:
+                    for message, user in events:
+                        await self._send(log_channel, audit_type, message, user)
+                    continue
+                users = ", ".join(str(user) for message, user in events if user is not None)
+                embed = discord.Embed(title=audit_type.digest.format(len(events), self.digest_interval),
+                                      description=users[:2048] or discord.Embed.Empty,
+                                      color=audit_type.color, timestamp=datetime.utcnow())
+                embed.set_footer(text="Auditing Digest")
+                await self.bot.messaging.send(log_channel, embed=embed, priority=dispatch.AUDIT)
+        finally:
+            self.windows.pop(key, None)
 
     @staticmethod
     def get_user_info(member):
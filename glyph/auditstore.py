@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class AuditStore(object):
+    """An append-only SQLite log of audit events.
+
+    Events are buffered in memory and written in batches by a single worker thread, so the event loop never waits on
+    the disk. The database runs in WAL mode and is indexed by guild, type and time, which is what the queries use.
+    Batches that fail to write are kept for the next flush, up to max_pending events, dropping the oldest beyond.
+    """
+
+    __slots__ = ["path", "flush_interval", "max_pending", "dropped", "_pending", "_executor", "_connection", "_task"]
+
+    def __init__(self, path, *, flush_interval=2, max_pending=50000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = []
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._connection = None
+        self._task = None
+
+    def record(self, guild_id, audit_type, user_id, message, *, timestamp=None):
+        self._pending.append((int(guild_id), audit_type, None if user_id is None else int(user_id),
+                              timestamp or time.time(), message))
+        self._trim()
+
+    def _trim(self):
+        excess = len(self._pending) - self.max_pending
+        if excess > 0:
+            del self._pending[:excess]
+            self.dropped += excess
+
+    def start(self, loop):
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._flusher())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._executor is None:
+            return
+        try:
+            await self.flush()
+        except sqlite3.Error as e:
+            log.warning("Failed to write {} audit events on close: {}".format(len(self._pending), e))
+        await self._run(self._disconnect)  # Closing the last connection merges the WAL into the database
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except sqlite3.Error as e:
+                log.warning("Failed to write {} audit events, retrying: {}".format(len(self._pending), e))
+
+    async def flush(self):
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            await self._run(self._write, rows)
+        except sqlite3.Error:
+            self._pending = rows + self._pending  # Kept in order ahead of the events recorded since
+            self._trim()
+            raise
+
+    async def count(self, guild_id, audit_type=None, *, since=None, until=None):
+        """Counts a guild's events, e.g. count(guild_id, "Member Joined", since=time.time() - 86400)."""
+        where, parameters = self._where(guild_id, audit_type, since, until)
+        rows = await self._run(self._read, "SELECT COUNT(*) FROM events WHERE " + where, parameters)
+        return rows[0][0]
+
+    async def query(self, guild_id, audit_type=None, *, since=None, until=None, limit=100):
+        """Returns a guild's most recent events as (type, user ID, timestamp, message) tuples."""
+        where, parameters = self._where(guild_id, audit_type, since, until)
+        return await self._run(self._read, "SELECT type, user_id, timestamp, message FROM events WHERE " + where +
+                               " ORDER BY timestamp DESC LIMIT ?", parameters + [limit])
+
+    @staticmethod
+    def _where(guild_id, audit_type, since, until):
+        where = ["guild_id = ?"]
+        parameters = [int(guild_id)]
+        if audit_type is not None:
+            where.append("type = ?")
+            parameters.append(audit_type)
+        if since is not None:
+            where.append("timestamp >= ?")
+            parameters.append(since)
+        if until is not None:
+            where.append("timestamp < ?")
+            parameters.append(until)
+        return " AND ".join(where), parameters
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self):
+        # Only ever called from the worker thread, which owns the connection
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, guild_id INTEGER, "
+                                     "type TEXT, user_id INTEGER, timestamp REAL, message TEXT)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS events_guild_type_time "
+                                     "ON events (guild_id, type, timestamp)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS events_guild_time ON events (guild_id, timestamp)")
+        return self._connection
+
+    def _disconnect(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except sqlite3.Error as e:
+                log.warning("Failed to close the audit store: {}".format(e))
+            self._connection = None
+
+    def _write(self, rows):
+        connection = self._connect()
+        with connection:
+            connection.executemany("INSERT INTO events (guild_id, type, user_id, timestamp, message) "
+                                   "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _read(self, sql, parameters):
+        return self._connect().execute(sql, parameters).fetchall()
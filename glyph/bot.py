@@ -1,15 +1,13 @@
 import asyncio
 import logging
+import math
 import random
-import re
-from datetime import datetime
-from json.decoder import JSONDecodeError
 from os import environ
 
 import discord
-import requests
 
-from . import apiai, auditing, fa, orchestrators, picarto, skills
+from . import (apiai, auditing, auditstore, fa, farms, guildconfig, intents, orchestrators, picarto, quickview,
+               ratelimit, scanner, skills, stats, web)
 from .serverconfig import ConfigDatabase
 
 log = logging.getLogger(__name__)
@@ -22,10 +20,24 @@ log.addHandler(ch)
 class GlyphBot(discord.Client):
 
     def __init__(self):
-        self.auditor = auditing.Auditor(self)
-        self.apiai = apiai.AIProcessor(client_access_token=environ.get("APIAI_TOKEN"))
-        self.configdb = ConfigDatabase(environ.get("DATABASE_URL"))
+        audit_store = auditstore.AuditStore(environ.get("AUDIT_STORE")) if environ.get("AUDIT_STORE") else None
+        self.auditor = auditing.Auditor(self, digest_interval=int(environ.get("AUDIT_DIGEST_INTERVAL", 10)),
+                                        store=audit_store)
+        self.apiai = apiai.AIProcessor(client_access_token=environ.get("APIAI_TOKEN"),
+                                       cache=apiai.ResponseCache(ttl=int(environ.get("AI_CACHE_TTL", 3600)),
+                                                                 path=environ.get("AI_CACHE")),
+                                       timeout=float(environ.get("AI_TIMEOUT", 3)),
+                                       max_pending=int(environ.get("AI_MAX_PENDING", 20)))
+        self.intents = intents.IntentMatcher()
+        self.configdb = ConfigDatabase(environ.get("DATABASE_URL"), snapshot_path=environ.get("CONFIG_SNAPSHOT"),
+                                       reconcile_interval=int(environ.get("CONFIG_SNAPSHOT_INTERVAL", 900)))
         self.messaging = orchestrators.MessagingOrchestrator(self, log)
+        self.permissions = orchestrators.PermissionCache(self)
+        self.scanner = scanner.MessageScanner()
+        self.quickview = quickview.QuickViewResolver(fan_out=int(environ.get("QUICKVIEW_FAN_OUT", 4)))
+        self.stats = stats.MemberStatistics()
+        self.farms = farms.FarmDetector(self, log)
+        self.limiter = ratelimit.MessageLimiter()
         self.ready = False
         self.incompletes = []
         self.skill_commander = skills.SkillCommander()
@@ -33,33 +45,52 @@ class GlyphBot(discord.Client):
 
     async def update_server_count(self):
         count = len(self.servers)
+        data = {"server_count": count}
         # Discord Bot List
         url = "https://discordbots.org/api/bots/{}/stats".format(self.user.id)
-        header = {"Content-Type": "application/json", "Authorization": environ.get("DISCORDBOTLIST_TOKEN")}
-        data = {"server_count": count}
-        req = requests.post(url, json=data, headers=header)
-        if req.status_code == 200:
+        header = {"Authorization": environ.get("DISCORDBOTLIST_TOKEN")}
+        try:
+            status, _ = await web.client.post(url, json_data=data, headers=header)
+        except web.WebError as e:
+            status = e
+        if status == 200:
             log.info("Updated Discord Bot List count with {} servers!".format(count))
         else:
-            log.warning("Failed to update Discord Bot List server count with error code {}!".format(req.status_code))
+            log.warning("Failed to update Discord Bot List server count with error code {}!".format(status))
         # Discord Bots
         url = "https://bots.discord.pw/api/bots/{}/stats".format(self.user.id)
-        header = {"Content-Type": "application/json", "Authorization": environ.get("DISCORDBOTS_TOKEN")}
-        data = {"server_count": count}
-        req = requests.post(url, json=data, headers=header)
-        if req.status_code == 200:
+        header = {"Authorization": environ.get("DISCORDBOTS_TOKEN")}
+        try:
+            status, _ = await web.client.post(url, json_data=data, headers=header)
+        except web.WebError as e:
+            status = e
+        if status == 200:
             log.info("Updated Discord Bots count with {} servers!".format(count))
         else:
-            log.warning("Failed to update Discord Bots server count with error code {}!".format(req.status_code))
+            log.warning("Failed to update Discord Bots server count with error code {}!".format(status))
 
     @property
     def total_members(self):
-        return sum(1 for _ in self.get_all_members())
+        return self.stats.total_members
 
     @property
     def total_servers(self):
         return len(self.servers)
 
+    async def close(self):
+        if self.is_closed:
+            return
+        self.farms.stop()
+        self.messaging.expiry.stop()
+        if self.auditor.store is not None:
+            await self.auditor.store.close()
+        await web.client.close()
+        self.apiai.cache.save()
+        await self.configdb.flush()
+        await self.configdb.reconcile()  # So the next start begins from a current snapshot
+        self.configdb.close()
+        await super().close()
+
     async def safe_kick(self, member):
         kick = None
         try:
@@ -89,176 +120,171 @@ class GlyphBot(discord.Client):
     async def on_ready(self):
         log.info("Logged in as {} ({})".format(self.user.name, self.user.id))
         await self.change_presence(game=discord.Game(name="Armax Arsenal Arena", type=random.choice([0,3])))
-        farm_servers = []
-        for server in list(self.servers):
-            total_members = len(server.members) or 1
-            total_bots = len(list(filter(lambda member: member.bot, server.members)))
-            total_humans = total_members - total_bots
-            percentage_bots = round(total_bots/total_members*100, 2)
-            if percentage_bots > 80 and total_members > 15:
-                farm_servers.append(server)
-                log.info("{}: Left server! Was {}% likely to be a bot farm with {} members, "
-                         "{} humans and {} bots!".format(
-                            server.name, percentage_bots, total_members, total_humans, total_bots))
-                await asyncio.sleep(2)  # Wait because of rate limiting
-                await self.leave_server(server)
-        log.info("Left {} bot farm server(s).".format(len(farm_servers)))
-        self.configdb.load_all()
-        log.info("Loaded {} configurations from the database.".format(len(self.configdb.configs)))
-        await self.update_server_count()
-        log.info("Connected to {} server(s) with {} members.".format(self.total_servers, self.total_members))
+        self.stats.seed(self.servers)
+        self.farms.start()
+        self.messaging.expiry.start()
+        if self.auditor.store is not None:
+            self.auditor.store.start(self.loop)
+        log.info("Queued {} bot farm server(s) to leave.".format(self.farms.sweep(self.servers)))
+        if not self.configdb.warm_start():
+            await self.configdb.load(0)  # The default configuration, the rest is loaded when first needed
+        self.configdb.start()  # Reconciles the snapshot with the database in the background
+        self.loop.create_task(self.configdb.prefetch(self.stats.busiest(int(environ.get("CONFIG_PREFETCH", 100)))))
         self.ready = True
+        log.info("Connected to {} server(s) with {} members.".format(self.total_servers, self.total_members))
+        await self.update_server_count()
 
     async def get_self_member(self, channel):
-        try:
-            member = discord.utils.get(channel.server.members, id=self.user.id)
-            if member is None:
-                member = self.user
-        except AttributeError:
-            member = self.user
-        return member
+        return self.permissions.member(getattr(channel, "server", None))
 
     async def on_message(self, message):
         if not self.ready:
             return
-        message = orchestrators.EnhancedMessage(self, message)
         # Don't talk to yourself
         if message.author == self.user or message.author.bot:
             return
+        message = orchestrators.EnhancedMessage(self, message)
         server = message.server
-        config = self.configdb.get(server)
+        config = await self.configdb.fetch(server)
+        # Scan the message once, only looking for a mention of the bot when it was mentioned
+        addressed = self.user in message.mentions
+        member = None
+        if addressed:
+            # Get the member of the bot so the mention can be removed from the message
+            member = await self.get_self_member(message.channel)
+        scan = self.scanner.scan(message.clean_content, mention=member.display_name if member else None)
         # Check for spoilery words
-        if config["spoilers"]["keywords"]:
-            spoilers_channel = config["spoilers"]["safe_channel"]
-            spoilers_keywords = set(map(lambda x: x.lower(), config["spoilers"]["keywords"]))
-            split_message = set(map(str.lower, re.findall(r"[\w']+", message.clean_content)))
-            if spoilers_keywords.intersection(split_message) and not (message.channel.name == spoilers_channel):
+        if config.spoilers and not (message.channel.name == config.spoilers_channel):
+            if config.spoilers.search(scan.content) is not None:
                 await self.messaging.add_reaction(message, "\u26A0")  # React with a warning emoji
         # FA QuickView
-        r = fa.Submission.regex
-        if r.search(message.clean_content) and config["quickview"]["fa"]["enabled"]:
-            links = r.findall(message.clean_content)
-            for link in links:
-                link_type = link[4]
-                link_id = link[5]
-                if link_type == "view":
-                    try:
-                        submission = fa.Submission(id=link_id)
-                        embed = submission.get_embed(thumbnail=config["quickview"]["fa"]["thumbnail"])
-                        await message.reply(embed=embed)
-                    except ValueError:
-                        pass
+        if scan.fa_ids and config.has(guildconfig.FA_QUICKVIEW):
+            submissions = await self.quickview.resolve(scan.fa_ids, lambda link_id: fa.Submission(id=link_id).fetch())
+            embeds = [submission.get_embed(thumbnail=config.has(guildconfig.FA_THUMBNAIL))
+                      for submission in submissions]
+            for embed in self.quickview.merge(embeds, footer="FurAffinity"):
+                await message.reply(embed=embed)
             return
         # Picarto QuickView
-        r = picarto.Channel.regex
-        if r.search(message.clean_content) and config["quickview"]["picarto"]["enabled"]:
-            links = r.findall(message.clean_content)
-            for link in links:
-                link_name = link[4]
-                try:
-                    channel = picarto.Channel(name=link_name)
-                    embed = channel.get_embed()
-                    await message.reply(embed=embed)
-                except ValueError:
-                    pass
+        if scan.picarto_names and config.has(guildconfig.PICARTO_QUICKVIEW):
+            channels = await self.quickview.resolve(scan.picarto_names,
+                                                    lambda link_name: picarto.Channel(name=link_name).fetch())
+            for embed in self.quickview.merge([channel.get_embed() for channel in channels], footer="Picarto"):
+                await message.reply(embed=embed)
             return
         # Check if the message should be replied to
-        if self.user in message.mentions or message.channel.is_private or message.author in self.incompletes:
-            # Check cooldowns
-            try:
-                def cooldown(prop):
-                    return self.cooldowns.get(message.author).get(prop)
-                if cooldown("time") > datetime.utcnow():
-                    if not cooldown("warned"):
-                        self.cooldowns.update(
-                            {message.author: {"time": cooldown("time"), "warned": True}})
-                        remaining = (cooldown("time") - datetime.now()).seconds % 60
-                        await message.reply("You are being ratelimited {}! Wait {} seconds.".format(
-                            message.author.mention, remaining))
-                    return
-            except (KeyError, TypeError, AttributeError):
-                pass
-            # Get the member of the bot so the mention can be removed from the message
-            member = await self.get_self_member(message.channel)
+        if addressed or message.channel.is_private or message.author in self.incompletes:
             # Check it the mention is at the beginning of the message and don't reply if not
-            if not message.clean_content.startswith("@{}".format(member.display_name)) \
-                    and not (message.channel.is_private or message.author in self.incompletes):
+            if not scan.mentioned and not (message.channel.is_private or message.author in self.incompletes):
                 return
-            # Remove the mention from the message so it can be processed right
-            clean_message = re.sub("@{}".format(member.display_name), "", message.clean_content).strip()
+            # The mention is removed from the message so it can be processed right
+            clean_message = scan.text
             if not clean_message:  # If there's no message
                 await message.reply("You have to say something.")
                 return
-            # Remove self from the list of mentions in the message
-            clean_mentions = message.mentions
-            try:
-                clean_mentions.remove(member)
-            except ValueError:
-                pass
-            # Ask api.ai how to handle the message
-            try:
-                ai = self.apiai.query(clean_message, message.author.id)
-            except JSONDecodeError:  # api.ai is down
-                await message.reply("Sorry, it appears api.ai is currently unavailable.\n Please try again later.")
+            # Check rate limits before spending an api.ai query
+            wait, warn = self.limiter.acquire(message.author.id, getattr(server, "id", None))
+            if wait:
+                if warn:
+                    await message.reply("You are being ratelimited {}! Wait {} seconds.".format(
+                        message.author.mention, math.ceil(wait)))
                 return
+            # Common commands are resolved locally, follow ups and everything else need api.ai
+            ai = None
+            if message.author not in self.incompletes:
+                ai = self.intents.match(clean_message, config=config)
+            if ai is None:
+                try:
+                    ai = await self.apiai.query(clean_message, message.author.id)
+                except apiai.AIUnavailable as e:  # api.ai is down, slow or overloaded
+                    log.warning("api.ai query failed: {}".format(e))
+                    await message.reply("Sorry, it appears api.ai is currently unavailable, so I only understand "
+                                        "simple commands like \"help\" or \"status\".\n Please try again later.")
+                    return
             # Do the action given by api.ai
             # if ai.action_incomplete:
             #     self.incompletes.add(message.author)
             # else:
-            #     self.cooldowns.update(
-            #         {message.author: {"time": datetime.utcnow() + timedelta(seconds=4), "warned": False}})
             #     try:
             #         self.incompletes.remove(message.author)
             #     except KeyError:
             #         pass
             await self.skill_commander.process(message, ai, config)
 
+    async def on_member_update(self, before, after):
+        if after.id == self.user.id:
+            self.permissions.invalidate_member(after.server)
+
+    async def on_server_role_update(self, before, after):
+        self.permissions.invalidate_server(after.server)
+
+    async def on_server_role_delete(self, role):
+        self.permissions.invalidate_server(role.server)
+
+    async def on_channel_create(self, channel):
+        if not channel.is_private:
+            self.auditor.invalidate(channel.server)
+
+    async def on_channel_update(self, before, after):
+        self.permissions.invalidate_channel(after)
+        if not after.is_private:
+            self.auditor.invalidate(after.server)
+
+    async def on_channel_delete(self, channel):
+        self.permissions.invalidate_channel(channel)
+        if not channel.is_private:
+            self.auditor.invalidate(channel.server)
+
     async def on_member_join(self, member):
+        self.stats.member_joined(member)
+        self.farms.evaluate(member.server)
         if not self.ready:
             return
         server = member.server
-        config = self.configdb.get(server)
-        if config["auditing"]["joins"]:
-            await self.auditor.audit(server, auditing.MEMBER_JOIN, self.auditor.get_user_info(member), user=member)
+        config = await self.configdb.fetch(server)
+        if config.has(guildconfig.AUDIT_JOINS) and self.auditor.route(server, config) is not None:
+            await self.auditor.audit(server, auditing.MEMBER_JOIN, self.auditor.get_user_info(member), user=member,
+                                     config=config)
 
     async def on_member_remove(self, member):
+        self.stats.member_left(member)
+        self.farms.evaluate(member.server)  # Humans leaving can tip a server over the bot threshold too
         if not self.ready:
             return
         server = member.server
-        config = self.configdb.get(server)
-        if config["auditing"]["leaves"]:
-            await self.auditor.audit(server, auditing.MEMBER_LEAVE, self.auditor.get_user_info(member), user=member)
+        config = await self.configdb.fetch(server)
+        if config.has(guildconfig.AUDIT_LEAVES) and self.auditor.route(server, config) is not None:
+            await self.auditor.audit(server, auditing.MEMBER_LEAVE, self.auditor.get_user_info(member), user=member,
+                                     config=config)
 
     async def on_reaction_add(self, reaction, user):
         if not self.ready:
             return
         server = reaction.message.server
-        config = self.configdb.get(server)
-        message = reaction.message
-        if config["auditing"]["reactions"]:
+        config = await self.configdb.fetch(server)
+        if config.has(guildconfig.AUDIT_REACTIONS) and self.auditor.route(server, config) is not None:
             await self.auditor.audit(server, auditing.REACTION_ADD,
                                      "{} added reaction {} to {}".format(user.mention,
                                                                          reaction.emoji,
                                                                          reaction.message.content),
-                                     user=user)
+                                     user=user, config=config)
 
     async def on_reaction_remove(self, reaction, user):
         if not self.ready:
             return
         server = reaction.message.server
-        config = self.configdb.get(server)
-        if config["auditing"]["reactions"]:
+        config = await self.configdb.fetch(server)
+        if config.has(guildconfig.AUDIT_REACTIONS) and self.auditor.route(server, config) is not None:
             await self.auditor.audit(server, auditing.REACTION_REMOVE,
                                      "{} removed reaction {} from {}".format(user.mention,
                                                                              reaction.emoji, reaction.message.content),
-                                     user=user)
+                                     user=user, config=config)
 
     async def on_message_delete(self, message):
         if not self.ready:
             return
-        if message.id in self.messaging.ledger:
-            data = self.messaging.ledger.get(message.id)
-            self.messaging.ledger.pop(message.id)
+        data = self.messaging.ledger.pop(message.id)
+        if data is not None:
             channel = self.get_channel(id=data[0])
             msg = await self.get_message(channel=channel, id=data[1])
             await self.messaging.add_reaction(msg, "\u274C")
@@ -266,15 +292,20 @@ class GlyphBot(discord.Client):
             await self.messaging.delete(msg)
 
     async def on_server_join(self, server):
+        self.stats.add_server(server)
+        self.farms.evaluate(server)
         if not self.ready:
             return
         log.info("{}: Added to server.".format(server))
         await self.update_server_count()
 
     async def on_server_remove(self, server):
+        self.stats.remove_server(server)
+        self.auditor.invalidate(server)
+        self.permissions.invalidate_member(server)
         if not self.ready:
             return
-        self.configdb.delete(server.id)
+        await self.configdb.delete(server.id)
         log.info("{}: Removed from server.".format(server))
         await self.update_server_count()
 
@@ -1,25 +1,29 @@
-import json
 import re
 from datetime import datetime
 
-import requests
 from discord import Embed
 
+from . import resilience, web
+
+upstream = resilience.Upstream("faexport", deadline=8, fresh_ttl=300, stale_ttl=3600)
+
 
 class Submission(object):
 
-    regex = re.compile("((http[s]?):\/\/)?(www\.)?(furaffinity.net)\/(\w*)\/(\d{8})\/?", re.IGNORECASE)
+    # The group names are unique among the links the scanner recognizes, which combines it with theirs
+    regex = re.compile(r"(?:https?://)?(?:www\.)?furaffinity\.net/(?P<fa_type>\w*)/(?P<fa_id>\d{8})/?", re.IGNORECASE)
 
     def __init__(self, *, url=None, id=None):
         if url is not None:
-            url_format = re.compile("((http[s]?):\/\/)?(www\.)?(furaffinity.net)\/(\w*)\/(\d{8})\/?", re.IGNORECASE)
-            link = url_format.search(url)
-            self.type = link.group(5)
-            self.id = link.group(6)
+            link = self.regex.search(url)
+            self.type = link.group("fa_type")
+            self.id = link.group("fa_id")
         else:
             self.id = id
-        get = requests.get("http://faexport.boothale.net/submission/{}.json".format(self.id)).text
-        submission_info = json.loads(get)
+
+    async def fetch(self):
+        url = "http://faexport.boothale.net/submission/{}.json".format(self.id)
+        submission_info = await upstream.call(self.id, lambda: web.client.get_json(url))
         self.title = submission_info.get("title")
         self.author = submission_info.get("name")
         self.posted = submission_info.get("posted")
@@ -39,6 +43,7 @@ class Submission(object):
             self.color = 0x0026FF
         else:  # rating=="Adult"
             self.color = 0xFF0000
+        return self
 
     def get_embed(self, *, thumbnail=False):
         embed = Embed(
@@ -0,0 +1,73 @@
+import asyncio
+
+import discord
+
+
+class FarmDetector(object):
+    """Leaves bot farm servers in the background.
+
+    Servers are classified with MemberStatistics.is_farm whenever their member counts change and queued to be left.
+    The queue is drained one server at a time, backing off when Discord rate limits the bot.
+    """
+
+    __slots__ = ["client", "log", "interval", "max_interval", "left", "_queue", "_queued", "_task"]
+
+    def __init__(self, client, logger, *, interval=2, max_interval=60):
+        self.client = client
+        self.log = logger
+        self.interval = interval
+        self.max_interval = max_interval
+        self.left = 0
+        self._queue = None
+        self._queued = set()
+        self._task = None
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._task is None or self._task.done():
+            self._task = self.client.loop.create_task(self._leave_worker())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def evaluate(self, server):
+        if self._queue is None or server.id in self._queued or not self.client.stats.is_farm(server):
+            return False
+        self._queued.add(server.id)
+        self._queue.put_nowait(server)
+        return True
+
+    def sweep(self, servers):
+        return sum(1 for server in list(servers) if self.evaluate(server))
+
+    async def _leave_worker(self):
+        interval = self.interval
+        while True:
+            server = await self._queue.get()
+            # Counts may have changed while the server was waiting in the queue
+            if server.id not in self.client.stats.servers or not self.client.stats.is_farm(server):
+                self._queued.discard(server.id)
+                continue
+            try:
+                await self.client.leave_server(server)
+            except discord.HTTPException as e:
+                if getattr(e.response, "status", None) == 429:
+                    interval = min(interval * 2, self.max_interval)
+                    self.log.warning("{}: Rate limited leaving bot farm, retrying in {} seconds.".format(
+                        server.name, interval))
+                    self._queue.put_nowait(server)
+                else:
+                    self._queued.discard(server.id)
+                    self.log.warning("{}: Cannot leave bot farm server, failed.".format(server.name))
+            else:
+                self._queued.discard(server.id)
+                self.left += 1
+                interval = self.interval
+                total_members, total_humans, total_bots = self.client.stats.get(server)
+                self.log.info("{}: Left server! Was {}% likely to be a bot farm with {} members, "
+                              "{} humans and {} bots!".format(server.name, self.client.stats.bot_percentage(server),
+                                                              total_members, total_humans, total_bots))
+            await asyncio.sleep(interval)  # Wait because of rate limiting
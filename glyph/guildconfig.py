@@ -0,0 +1,111 @@
+from .spoilers import KeywordMatcher
+
+FA_QUICKVIEW = 1 << 0
+FA_THUMBNAIL = 1 << 1
+PICARTO_QUICKVIEW = 1 << 2
+AUDIT_JOINS = 1 << 3
+AUDIT_LEAVES = 1 << 4
+AUDIT_REACTIONS = 1 << 5
+
+
+class GuildConfig(object):
+    """The configuration of a single guild.
+
+    Boolean settings are packed into a feature bitmask, and the lowercased role names and the spoiler keyword matcher
+    are worked out once when the config is loaded. to_dict and from_dict round trip the JSON format used for hastes.
+    """
+
+    __slots__ = ["wiki", "selectable_roles", "selectable_roles_lower", "spoilers_channel", "spoilers_keywords",
+                 "auditing_channel", "features", "_spoilers"]
+
+    def __init__(self, *, wiki=None, selectable_roles=None, spoilers_channel=None, spoilers_keywords=None,
+                 auditing_channel=None, features=0):
+        self.wiki = wiki
+        self.selectable_roles = list(selectable_roles or [])
+        self.selectable_roles_lower = frozenset(role.lower() for role in self.selectable_roles)
+        self.spoilers_channel = spoilers_channel
+        self.spoilers_keywords = list(spoilers_keywords or [])
+        self.auditing_channel = auditing_channel
+        self.features = features
+        self._spoilers = None
+
+    def has(self, feature):
+        return self.features & feature == feature
+
+    @property
+    def spoilers(self):
+        """The compiled matcher of the spoiler keywords."""
+        if self._spoilers is None:
+            self._spoilers = KeywordMatcher(self.spoilers_keywords)
+        return self._spoilers
+
+    def reuse_spoilers(self, previous):
+        """Takes over the compiled matcher of a previous config of the guild if the keywords did not change."""
+        if previous is not None and previous._spoilers is not None and \
+                previous._spoilers.keywords == KeywordMatcher.normalize(self.spoilers_keywords):
+            self._spoilers = previous._spoilers
+
+    @staticmethod
+    def _pack(*flags):
+        return sum(feature for feature, enabled in flags if enabled)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(wiki=row["wiki"],
+                   selectable_roles=row["selectable_roles"],
+                   spoilers_channel=row["spoilers_channel"],
+                   spoilers_keywords=row["spoilers_keywords"],
+                   auditing_channel=row["auditing_channel"],
+                   features=cls._pack((FA_QUICKVIEW, row["fa_quickview_enabled"]),
+                                      (FA_THUMBNAIL, row["fa_quickview_thumbnail"]),
+                                      (PICARTO_QUICKVIEW, row["picarto_quickview_enabled"]),
+                                      (AUDIT_JOINS, row["auditing_joins"]),
+                                      (AUDIT_LEAVES, row["auditing_leaves"]),
+                                      (AUDIT_REACTIONS, row["auditing_reactions"])))
+
+    @classmethod
+    def from_dict(cls, config):
+        return cls(wiki=config["wiki"],
+                   selectable_roles=config["roles"]["selectable"],
+                   spoilers_channel=config["spoilers"]["safe_channel"],
+                   spoilers_keywords=config["spoilers"]["keywords"],
+                   auditing_channel=config["auditing"]["channel"],
+                   features=cls._pack((FA_QUICKVIEW, config["quickview"]["fa"]["enabled"]),
+                                      (FA_THUMBNAIL, config["quickview"]["fa"]["thumbnail"]),
+                                      (PICARTO_QUICKVIEW, config["quickview"]["picarto"]["enabled"]),
+                                      (AUDIT_JOINS, config["auditing"]["joins"]),
+                                      (AUDIT_LEAVES, config["auditing"]["leaves"]),
+                                      (AUDIT_REACTIONS, config["auditing"]["reactions"])))
+
+    def to_dict(self):
+        return {
+            "roles": {
+              "selectable": self.selectable_roles
+            },
+            "quickview": {
+              "fa": {
+                "enabled": self.has(FA_QUICKVIEW),
+                "thumbnail": self.has(FA_THUMBNAIL)
+              },
+              "picarto": {
+                "enabled": self.has(PICARTO_QUICKVIEW)
+              }
+            },
+            "spoilers": {
+              "safe_channel": self.spoilers_channel,
+              "keywords": self.spoilers_keywords
+            },
+            "auditing": {
+              "channel": self.auditing_channel,
+              "joins": self.has(AUDIT_JOINS),
+              "leaves": self.has(AUDIT_LEAVES),
+              "reactions": self.has(AUDIT_REACTIONS)
+            },
+            "wiki": self.wiki
+        }
+
+    def to_parameters(self, guild_id):
+        """Returns the serverconfigs row of the config, in column order."""
+        return [int(guild_id), self.wiki, self.selectable_roles, self.spoilers_channel, self.spoilers_keywords,
+                self.has(FA_QUICKVIEW), self.has(FA_THUMBNAIL), self.has(PICARTO_QUICKVIEW), self.auditing_channel,
+                self.has(AUDIT_JOINS), self.has(AUDIT_LEAVES), self.has(AUDIT_REACTIONS)]
@@ -1,17 +1,19 @@
 import json
 
-import requests
+from . import resilience, web
 
+upstream = resilience.Upstream("hastebin", deadline=10, fresh_ttl=3600)  # Hastes never change
 
-def post(text):
-    response = requests.post("https://hastebin.com/documents", text)
+
+async def post(text):
     try:
-        haste = "https://hastebin.com/" + json.loads(response.text)["key"]
-    except json.JSONDecodeError:
+        status, body = await upstream.call(None, lambda: web.client.post("https://hastebin.com/documents", data=text),
+                                           idempotent=False)
+        haste = "https://hastebin.com/" + json.loads(body)["key"]
+    except (json.JSONDecodeError, KeyError, web.WebError):
         haste = "Couldn't post to hastebin!"
     return haste
 
 
-def get(key):
-    response = requests.get("https://hastebin.com/raw/" + key)
-    return response.text
+async def get(key):
+    return await upstream.call(key, lambda: web.client.get_text("https://hastebin.com/raw/" + key))
@@ -0,0 +1,111 @@
+import re
+
+import pytz
+
+from .apiai import AIResponse
+
+_mention = r"(?:@\S+|me)"  # Mentions as they appear in clean_content
+_duration = r"(?P<amount>\d+) ?(?P<unit>s|secs?|seconds?|m|mins?|minutes?|h|hrs?|hours?|d|days?|w|wks?|weeks?)"
+_multireddit = r"/?r/(?P<multireddit>\w+(?:\+\w+)*)"
+
+# The action each phrase resolves to, the phrases are matched against the whole normalized message
+_phrases = [
+    ("skill.help", r"help|help me|commands|what can you do|what do you do"),
+    ("skill.status", r"status|stats|statistics|(?:show |what is |whats )?(?:your|the) status"),
+    ("skill.time", r"time|what time is it|whats the time|what is the time|(?:the )?current time"),
+    ("skill.time", r"(?:what time is it|whats the time|what is the time|(?:the )?time) in (?P<timezone>[\w/ +-]+)"),
+    ("skill.time", r"(?:whats the |what is the )?(?P<timezone>[\w/ +-]+?) time"),
+    ("skill.role.list", r"roles|(?:list|show|what are)(?: the| your| all)?(?: available| selectable)? roles"
+                        r"|what roles are (?:there|available)|(?:available|selectable) roles"),
+    ("skill.role.set", r"set {} (?:as|to) (?:an? )?(?P<role>[\w -]+)".format(_mention)),
+    ("skill.role.set", r"set my role (?:as|to) (?:an? )?(?P<role>[\w -]+)"),
+    ("skill.role.set", r"make {} (?:an? )(?P<role>[\w -]+)".format(_mention)),
+    ("skill.role.set", r"i want to be (?:an? )(?P<role>[\w -]+)"),
+    ("skill.role.set", r"give {} the (?P<role>[\w -]+) role".format(_mention)),
+    ("skill.reddit", _multireddit),
+    ("skill.reddit", r"(?:show me |give me |send me |get me |post )?(?:an? |some )?(?:image|picture|pic|photo|post)s? "
+                     r"(?:from|of) " + _multireddit),
+    ("skill.moderation.purge", r"purge (?:the )?(?:messages )?(?:from |for |since )?(?:the )?(?:last |past )?" +
+                               _duration),
+]
+
+# Units as api.ai's @sys.duration entity gives them, which the purge skill reads
+_units = {"s": "s", "m": "min", "h": "h", "d": "day", "w": "wk"}
+
+
+class IntentMatcher(object):
+    """Resolves common, deterministic commands locally instead of asking api.ai.
+
+    Every phrase of the table is compiled into one anchored pattern, so matching a message is a single regex match.
+    A message only resolves locally when it matches a phrase as a whole and all of its slots resolve, anything less
+    certain returns None and should go to api.ai.
+    """
+
+    __slots__ = ["pattern", "slots", "timezones", "stats"]
+
+    def __init__(self, phrases=None):
+        phrases = _phrases if phrases is None else phrases
+        alternatives = []
+        self.slots = {}  # Group name of each phrase to its action and the group names of its slots
+        for index, (action, phrase) in enumerate(phrases):
+            names = {}
+
+            def rename(match):
+                names[match.group(1)] = "p{}_{}".format(index, match.group(1))
+                return "(?P<{}>".format(names[match.group(1)])
+            phrase = re.sub(r"\(\?P<(\w+)>", rename, phrase)
+            alternatives.append("(?P<p{}>{})".format(index, phrase))
+            self.slots["p{}".format(index)] = (action, names)
+        self.pattern = re.compile("|".join(alternatives), re.IGNORECASE)
+        self.timezones = self._timezones()
+        self.stats = {"local": 0, "fallthrough": 0}
+
+    @staticmethod
+    def _timezones():
+        timezones = {}
+        for timezone in pytz.all_timezones:
+            timezones[timezone.lower()] = timezone
+            city = timezone.rsplit("/", 1)[-1].replace("_", " ").lower()
+            timezones.setdefault(city, timezone)
+        return timezones
+
+    @staticmethod
+    def normalize(text):
+        text = re.sub(r"[^\w\s/+@-]", "", text)
+        return " ".join(text.split())
+
+    def match(self, text, *, config=None):
+        """Returns an AIResponse for text if it is a command that can be answered locally, otherwise None.
+
+        Roles only resolve when they are one of the selectable roles of config, the guild's GuildConfig.
+        """
+        match = self.pattern.fullmatch(self.normalize(text))
+        parameters = None
+        if match is not None:
+            action, names = self.slots[match.lastgroup]
+            parameters = self._parameters({slot: match.group(name) for slot, name in names.items()}, config)
+        if parameters is None:
+            self.stats["fallthrough"] += 1
+            return None
+        self.stats["local"] += 1
+        return AIResponse({"result": {"action": action, "actionIncomplete": False, "parameters": parameters,
+                                      "contexts": [], "fulfillment": {"speech": ""}}})
+
+    def _parameters(self, slots, config):
+        # Returns the parameters as api.ai would give them, or None if a slot can't be resolved
+        parameters = {}
+        if "timezone" in slots:
+            timezone = self.timezones.get(slots["timezone"].strip().lower())
+            if timezone is None:
+                return None
+            parameters["timezone"] = timezone
+        if "role" in slots:
+            role = slots["role"].strip()
+            if config is None or role.lower() not in config.selectable_roles_lower:
+                return None
+            parameters["role"] = role
+        if "amount" in slots:
+            parameters["duration"] = {"amount": int(slots["amount"]), "unit": _units[slots["unit"][0].lower()]}
+        if "multireddit" in slots:
+            parameters["multireddit"] = slots["multireddit"]
+        return parameters
@@ -1,3 +1,4 @@
 from .messaging import MessagingOrchestrator, EnhancedMessage
+from .permissions import PermissionCache
 
-__all__ = ["MessagingOrchestrator", "EnhancedMessage"]
\ No newline at end of file
+__all__ = ["MessagingOrchestrator", "EnhancedMessage", "PermissionCache"]
\ No newline at end of file
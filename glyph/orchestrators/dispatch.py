@@ -0,0 +1,147 @@
+import asyncio
+import heapq
+import itertools
+from datetime import datetime
+
+import discord
+
+from ..ratelimit import TokenBucketLimiter
+
+REPLY = 0
+AUDIT = 1
+
+SEND = "send"
+REACT = "react"
+GLOBAL = "global"
+
+# Discord's limits of an embed, the characters count across its title, description, fields and footer
+EMBED_FIELDS = 25
+EMBED_CHARACTERS = 6000
+FIELD_NAME = 256
+FIELD_VALUE = 1024
+
+
+class _Item(object):
+
+    __slots__ = ["priority", "sequence", "call", "embed", "future"]
+
+    def __init__(self, priority, sequence, call, embed, future):
+        self.priority = priority
+        self.sequence = sequence
+        self.call = call
+        self.embed = embed
+        self.future = future
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class OutboundDispatcher(object):
+    """Queues outbound Discord calls per channel and route.
+
+    Each queue is drained by its own task, which spends from a local model of Discord's per-channel route buckets so
+    calls wait before Discord would answer with a 429. Every call also spends from a global budget shared by all
+    channels, which is handed out in priority order, so replies go before audit traffic anywhere. Queued embeds that
+    allow it are coalesced into a single message.
+    """
+
+    __slots__ = ["client", "log", "budgets", "queues", "workers", "_sequence", "_global_waiters", "_granter"]
+
+    coalesce_limit = 10
+
+    def __init__(self, client, logger):
+        self.client = client
+        self.log = logger
+        self.budgets = {
+            SEND: TokenBucketLimiter(rate=1, capacity=5),  # 5 messages per 5 seconds per channel
+            REACT: TokenBucketLimiter(rate=4, capacity=1),  # 1 reaction per 0.25 seconds per channel
+            GLOBAL: TokenBucketLimiter(rate=50, capacity=50)  # 50 requests per second across the bot
+        }
+        self.queues = {}
+        self.workers = {}
+        self._sequence = itertools.count()
+        self._global_waiters = []  # Heap of (priority, sequence, future) waiting for the global budget
+        self._granter = None
+
+    def submit(self, channel, call=None, *, embed=None, route=SEND, priority=REPLY):
+        """Queues call, or an embed that may be coalesced, and returns a future of its result."""
+        key = (channel.id, route)
+        future = self.client.loop.create_future()
+        heapq.heappush(self.queues.setdefault(key, []), _Item(priority, next(self._sequence), call, embed, future))
+        worker = self.workers.get(key)
+        if worker is None or worker.done():
+            self.workers[key] = self.client.loop.create_task(self._drain(channel, key))
+        return future
+
+    async def _drain(self, channel, key):
+        queue = self.queues[key]
+        budget = self.budgets[key[1]]
+        try:
+            while queue:
+                wait, _ = budget.acquire(channel.id)
+                if wait:
+                    await asyncio.sleep(wait)
+                    continue
+                items = [heapq.heappop(queue)]
+                if items[0].embed is not None:
+                    size = len(items[0].embed.footer.text or "") + 16 + self._field_size(items[0].embed)
+                    while queue and queue[0].embed is not None and len(items) < self.coalesce_limit:
+                        size += self._field_size(queue[0].embed)
+                        if size > EMBED_CHARACTERS:
+                            break
+                        items.append(heapq.heappop(queue))
+                    call = self._coalesce(channel, [item.embed for item in items])
+                else:
+                    call = items[0].call
+                await self._acquire_global(items[0].priority)
+                try:
+                    result = await call()
+                except Exception as e:
+                    for item in items:
+                        if not item.future.done():
+                            item.future.set_exception(e)
+                else:
+                    for item in items:
+                        if not item.future.done():
+                            item.future.set_result(result)
+        finally:
+            if not queue:
+                self.queues.pop(key, None)
+            self.workers.pop(key, None)
+
+    async def _acquire_global(self, priority):
+        if not self._global_waiters:
+            wait, _ = self.budgets[GLOBAL].acquire(GLOBAL)
+            if not wait:
+                return
+        future = self.client.loop.create_future()
+        heapq.heappush(self._global_waiters, (priority, next(self._sequence), future))
+        if self._granter is None or self._granter.done():
+            self._granter = self.client.loop.create_task(self._grant())
+        await future
+
+    async def _grant(self):
+        # Hands out global tokens as they refill, the highest priority waiter first
+        while self._global_waiters:
+            wait, _ = self.budgets[GLOBAL].acquire(GLOBAL)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._global_waiters)
+            if not future.done():
+                future.set_result(None)
+
+    def _field_size(self, embed):
+        return len((embed.title or "Event")[:FIELD_NAME]) + len((embed.description or "-")[:FIELD_VALUE])
+
+    def _coalesce(self, channel, embeds):
+        if len(embeds) == 1:
+            embed = embeds[0]
+        else:
+            embed = discord.Embed(title="{} events".format(len(embeds)), color=embeds[0].color,
+                                  timestamp=datetime.utcnow())
+            for item in embeds:
+                embed.add_field(name=(item.title or "Event")[:FIELD_NAME],
+                                value=(item.description or "-")[:FIELD_VALUE], inline=False)
+            embed.set_footer(text=embeds[0].footer.text)
+        return lambda: self.client.send_message(channel, embed=embed)
@@ -0,0 +1,150 @@
+import asyncio
+import heapq
+import json
+import time
+from collections import defaultdict
+
+import discord
+
+
+class ExpiryScheduler(object):
+    """Deletes messages once they expire.
+
+    Pending deletions sit in a heap ordered by deadline and are handled by a single task that sleeps until the earliest
+    one. Messages that expire together are bulk deleted per channel when the bot may manage messages there. When a
+    path is given, pending deletions are saved to it so they survive restarts.
+    """
+
+    __slots__ = ["client", "log", "path", "_heap", "_dirty", "_saved", "_task", "_wakeup"]
+
+    bulk_limit = 100  # Discord's limit of messages per bulk delete
+    bulk_age = 14 * 86400 - 60  # Discord refuses to bulk delete messages older than two weeks
+    save_interval = 10  # Seconds between saves of the pending deletions, at most
+
+    def __init__(self, client, logger, *, path=None):
+        self.client = client
+        self.log = logger
+        self.path = path
+        self._heap = []
+        self._dirty = False
+        self._saved = 0
+        self._task = None
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, message, delay):
+        server = getattr(message, "server", None)
+        entry = (time.time() + delay, message.channel.id, message.id, None if server is None else server.id)
+        heapq.heappush(self._heap, entry)
+        self._dirty = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._load()
+        if self._task is None or self._task.done():
+            self._task = self.client.loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._wakeup is not None:  # Otherwise the saved expirations were never loaded and would be overwritten
+            self._save()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if self._dirty and self.path is not None:
+                since_save = time.monotonic() - self._saved
+                if since_save >= self.save_interval:
+                    await self._save_later()
+                else:  # Wake up for the save even if nothing expires before it
+                    timeout = min(timeout, self.save_interval - since_save) \
+                        if timeout is not None else self.save_interval - since_save
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = defaultdict(list)
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, channel_id, message_id, server_id = heapq.heappop(self._heap)
+                due[(channel_id, server_id)].append(message_id)
+            self._dirty = True
+            for (channel_id, server_id), message_ids in due.items():
+                await self._delete(channel_id, server_id, message_ids)
+
+    @staticmethod
+    def _created(message_id):
+        # Snowflakes carry their creation time in milliseconds since Discord's epoch
+        return ((int(message_id) >> 22) + 1420070400000) / 1000
+
+    async def _delete(self, channel_id, server_id, message_ids):
+        channel = self.client.get_channel(channel_id)
+        singles = message_ids
+        if channel is not None and server_id is not None and len(message_ids) > 1 and \
+                self.client.permissions.permissions_for(channel).manage_messages:
+            cutoff = time.time() - self.bulk_age
+            recent = [message_id for message_id in message_ids if self._created(message_id) > cutoff]
+            singles = [message_id for message_id in message_ids if self._created(message_id) <= cutoff]
+            for start in range(0, len(recent), self.bulk_limit):
+                chunk = recent[start:start + self.bulk_limit]
+                if len(chunk) == 1:
+                    singles.extend(chunk)
+                    continue
+                try:
+                    await self.client.http.delete_messages(channel_id, chunk, server_id)
+                except discord.Forbidden:
+                    self.log.warning("{}: Cannot delete expired messages, no permission?".format(channel_id))
+                    return
+                except discord.HTTPException:  # A rejected chunk is deleted message by message instead
+                    singles.extend(chunk)
+        for message_id in singles:
+            try:
+                await self.client.http.delete_message(channel_id, message_id, server_id)
+            except discord.Forbidden:
+                self.log.warning("{}: Cannot delete expired messages, no permission?".format(channel_id))
+                return
+            except discord.NotFound:
+                self.log.warning("{}: Cannot delete expired message, already deleted?".format(channel_id))
+            except discord.HTTPException:
+                self.log.warning("{}: Cannot delete expired message, failed.".format(channel_id))
+
+    def _load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r") as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return
+        self._heap.extend(tuple(entry) for entry in entries)
+        heapq.heapify(self._heap)
+        self.log.info("Restored {} pending message expirations.".format(len(entries)))
+
+    async def _save_later(self):
+        # Serialized and written on the executor, from a copy so scheduling can go on meanwhile
+        self._dirty = False
+        self._saved = time.monotonic()
+        await self.client.loop.run_in_executor(None, self._write, list(self._heap))
+
+    def _save(self):
+        self._dirty = False
+        if self.path is None:
+            return
+        self._write(self._heap)
+
+    def _write(self, entries):
+        try:
+            with open(self.path, "w") as file:
+                json.dump(entries, file)
+        except OSError:
+            self.log.warning("Cannot save pending message expirations to {}.".format(self.path))
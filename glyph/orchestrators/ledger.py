@@ -0,0 +1,77 @@
+import time
+from array import array
+from collections import OrderedDict
+
+
+class ReplyLedger(object):
+    """Maps trigger message IDs to the reply the bot sent for them.
+
+    Snowflakes are stored as integers in flat arrays indexed by slot, with an OrderedDict keeping the slots in least
+    recently used order. Entries are evicted once they are older than max_age or when max_entries is reached.
+    """
+
+    __slots__ = ["max_entries", "max_age", "_slots", "_free", "_channels", "_messages", "_times",
+                 "hits", "misses", "evictions"]
+
+    def __init__(self, *, max_entries=50000, max_age=86400):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._slots = OrderedDict()  # Trigger ID to slot
+        self._free = []
+        self._channels = array("Q")
+        self._messages = array("Q")
+        self._times = array("d")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, trigger_id):
+        return int(trigger_id) in self._slots
+
+    def add(self, trigger_id, channel_id, message_id):
+        now = time.monotonic()
+        self._evict(now)
+        trigger_id = int(trigger_id)
+        slot = self._slots.pop(trigger_id, None)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._times)
+                self._channels.append(0)
+                self._messages.append(0)
+                self._times.append(0)
+        self._channels[slot] = int(channel_id)
+        self._messages[slot] = int(message_id)
+        self._times[slot] = now
+        self._slots[trigger_id] = slot
+
+    def pop(self, trigger_id):
+        """Removes and returns the (channel ID, message ID) of the reply to a trigger, or None."""
+        slot = self._slots.pop(int(trigger_id), None)
+        if slot is None or time.monotonic() - self._times[slot] > self.max_age:
+            if slot is not None:
+                self._free.append(slot)
+                self.evictions += 1
+            self.misses += 1
+            return None
+        self._free.append(slot)
+        self.hits += 1
+        return str(self._channels[slot]), str(self._messages[slot])
+
+    def _evict(self, now):
+        slots = self._slots
+        while slots:
+            trigger_id, slot = next(iter(slots.items()))
+            if now - self._times[slot] <= self.max_age and len(slots) < self.max_entries:
+                break
+            slots.popitem(last=False)
+            self._free.append(slot)
+            self.evictions += 1
+
+    @property
+    def stats(self):
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -1,17 +1,22 @@
-import asyncio
+from os import environ
 
 import discord
 
+from . import dispatch
+from .expiry import ExpiryScheduler
+from .ledger import ReplyLedger
+
 
 class MessagingOrchestrator:
 
-    __slots__ = ["client", "log", "ledger", "cooldowns", "incompletes"]
+    __slots__ = ["client", "log", "ledger", "expiry", "dispatcher", "incompletes"]
 
     def __init__(self, client, logger):
         self.client = client
         self.log = logger
-        self.ledger = {}
-        self.cooldowns = {}
+        self.ledger = ReplyLedger()
+        self.expiry = ExpiryScheduler(client, logger, path=environ.get("EXPIRY_STORE"))
+        self.dispatcher = dispatch.OutboundDispatcher(client, logger)
         self.incompletes = set()
 
     async def send_typing(self, message):
@@ -28,7 +33,8 @@ class MessagingOrchestrator:
         except discord.HTTPException:
             self.log.warning("{} - {}: Cannot send typing, failed.".format(destination.server, destination.name))
 
-    async def send(self, destination, content=None, *, embed=None, expire_time=0, trigger=None):
+    async def send(self, destination, content=None, *, embed=None, expire_time=0, trigger=None,
+                   priority=dispatch.REPLY, coalesce=False):
 
         if content is None and embed is None:
             self.log.error("A message needs to have content!")
@@ -36,29 +42,34 @@ class MessagingOrchestrator:
 
         msg = None
         try:
-            if destination.permissions_for(await self.client.get_self_member(destination)).embed_links:
-                msg = await self.client.send_message(destination, content, embed=embed)
+            if self.client.permissions.permissions_for(destination).embed_links:
+                if coalesce and content is None:
+                    msg = await self.dispatcher.submit(destination, embed=embed, priority=priority)
+                else:
+                    msg = await self.dispatcher.submit(
+                        destination, lambda: self.client.send_message(destination, content, embed=embed),
+                        priority=priority)
             elif embed is not None:
                 try:
                     tabulated_description = embed.description.replace("\n", "\n\t")
                 except AttributeError:
                     tabulated_description = None
-                msg = await self.client.send_message(destination,
-                                                     "**Title** \n\t{}\n**Description** \n\t{}\n**Images** \n\t{}\n\t{}"
-                                                     "\n*No embed permission compatibility mode, "
-                                                     "please grant embed permission*".format(embed.title,
-                                                                                             tabulated_description,
-                                                                                             embed.image.url,
-                                                                                             embed.thumbnail.url))
+                compatible = "**Title** \n\t{}\n**Description** \n\t{}\n**Images** \n\t{}\n\t{}" \
+                             "\n*No embed permission compatibility mode, " \
+                             "please grant embed permission*".format(embed.title, tabulated_description,
+                                                                     embed.image.url, embed.thumbnail.url)
+                msg = await self.dispatcher.submit(destination,
+                                                   lambda: self.client.send_message(destination, compatible),
+                                                   priority=priority)
             else:
-                msg = await self.client.send_message(destination, content)
+                msg = await self.dispatcher.submit(destination, lambda: self.client.send_message(destination, content),
+                                                   priority=priority)
 
             if msg and expire_time:
-                await asyncio.sleep(expire_time)
-                await self.delete(msg)
+                self.expiry.schedule(msg, expire_time)
 
-            if trigger is not None:
-                self.ledger.update({trigger.id: (msg.channel.id, msg.id)})
+            if msg is not None and trigger is not None:
+                self.ledger.add(trigger.id, msg.channel.id, msg.id)
 
         except discord.Forbidden:
             self.log.warning("{} - {}: Cannot send message, no permission?".format(destination.server,
@@ -79,11 +90,10 @@ class MessagingOrchestrator:
         if clear_reactions:
             await self.clear_reactions(message)
         try:
-            msg = await self.client.edit_message(message=message, new_content=new, embed=embed)
+            msg = await self.client.edit_message(message=unwrap(message), new_content=new, embed=embed)
 
             if msg and expire_time:
-                await asyncio.sleep(expire_time)
-                await self.delete(msg)
+                self.expiry.schedule(msg, expire_time)
         except discord.NotFound:
             self.log.warning("Cannot edit message \"{}\", message not found".format(message.clean_content))
         except discord.HTTPException:
@@ -93,7 +103,7 @@ class MessagingOrchestrator:
 
     async def delete(self, message):
         try:
-            return await self.client.delete_message(message)
+            return await self.client.delete_message(unwrap(message))
         except discord.Forbidden:
             self.log.warning("Cannot delete message \"{}\", no permission?".format(message.clean_content))
         except discord.NotFound:
@@ -114,7 +124,8 @@ class MessagingOrchestrator:
     async def add_reaction(self, message, emoji):
         channel = message.channel
         try:
-            await self.client.add_reaction(message, emoji)
+            await self.dispatcher.submit(channel, lambda: self.client.add_reaction(unwrap(message), emoji),
+                                         route=dispatch.REACT)
             return True
         except discord.Forbidden:
             self.log.warning("{} - {}: Cannot add reaction, no permission?".format(channel.server, channel.name))
@@ -127,7 +138,7 @@ class MessagingOrchestrator:
         if channel.is_private:
             return
         try:
-            await self.client.clear_reactions(message)
+            await self.client.clear_reactions(unwrap(message))
         except discord.Forbidden:
             self.log.warning("{} - {}: Cannot clear reactions, no permission?".format(channel.server, channel.name))
         except discord.NotFound:
@@ -135,23 +146,39 @@ class MessagingOrchestrator:
                                                                                                channel.name))
 
 
-class EnhancedMessage(discord.Message):
+class EnhancedMessage(object):
+    """A thin wrapper around a discord.Message that delegates every other attribute to it."""
 
-    __slots__ = discord.Message.__slots__ + ["client", "clean_mentions", "ai", "config"]
+    __slots__ = ["client", "message", "ai", "config", "_clean_mentions"]
 
     def __init__(self, client, message):
-        super().__init__(reactions=message.reactions)
         self.client = client
-        self.clean_mentions = self._get_clean_mentions()
-        for slot in message.__slots__:
-            if hasattr(message, slot):
-                self.__setattr__(slot, getattr(message, slot))
+        self.message = message
+        self.ai = None
+        self.config = None
+        self._clean_mentions = None
+
+    def __getattr__(self, item):
+        return getattr(self.message, item)
+
+    def __eq__(self, other):
+        return self.message == unwrap(other)
+
+    def __hash__(self):
+        return hash(self.message)
+
+    @property
+    def clean_mentions(self):
+        if self._clean_mentions is None:
+            self._clean_mentions = self._get_clean_mentions()
+        return self._clean_mentions
 
-    async def reply(self, content=None, *, embed=None, preserve=False):
+    async def reply(self, content=None, *, embed=None, expire_time=0, preserve=False):
         trigger = self
         if preserve:
             trigger = None
-        return await self.client.messaging.send(self.channel, content=content, embed=embed, trigger=trigger)
+        return await self.client.messaging.send(self.channel, content=content, embed=embed, expire_time=expire_time,
+                                                trigger=trigger)
 
     async def delete(self):
         await self.client.messaging.delete(self)
@@ -164,17 +191,12 @@ class EnhancedMessage(discord.Message):
         return await self.client.messaging.add_reaction(self, emoji)
 
     def _get_clean_mentions(self):
-        # Get the member of the bot so the mention can be removed from the message
-        try:
-            member = discord.utils.get(self.server.members, id=self.client.user.id)
-            if member is None:
-                member = self.client.user
-        except AttributeError:
-            member = self.client.user
-            # Remove self from the list of mentions in the message
-        clean_mentions = self.mentions
-        try:
-            clean_mentions.remove(member)
-        except ValueError:
-            pass
-        return clean_mentions
+        # Remove self from the list of mentions in the message without touching the original list
+        bot_id = self.client.user.id
+        return [mention for mention in self.mentions if mention.id != bot_id]
+
+
+def unwrap(message):
+    if isinstance(message, EnhancedMessage):
+        return message.message
+    return message
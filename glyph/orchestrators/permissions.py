@@ -0,0 +1,47 @@
+class PermissionCache(object):
+    """Caches the bot's own member per server and its effective permissions per channel.
+
+    Entries are dropped by the bot's member, role and channel update events, so lookups on send stay O(1). Private
+    channels aren't cached, their permissions are fixed and cheap to compute, and nothing would ever drop them.
+    """
+
+    __slots__ = ["client", "members", "permissions"]
+
+    def __init__(self, client):
+        self.client = client
+        self.members = {}
+        self.permissions = {}
+
+    def member(self, server):
+        if server is None:
+            return self.client.user
+        member = self.members.get(server.id)
+        if member is None:
+            member = server.get_member(self.client.user.id) or self.client.user
+            self.members[server.id] = member
+        return member
+
+    def permissions_for(self, channel):
+        server = getattr(channel, "server", None)
+        if server is None:
+            return channel.permissions_for(self.client.user)
+        channels = self.permissions.get(server.id)
+        if channels is None:
+            channels = self.permissions[server.id] = {}
+        permissions = channels.get(channel.id)
+        if permissions is None:
+            permissions = channels[channel.id] = channel.permissions_for(self.member(server))
+        return permissions
+
+    def invalidate_member(self, server):
+        self.members.pop(server.id, None)
+        self.permissions.pop(server.id, None)
+
+    def invalidate_server(self, server):
+        self.permissions.pop(server.id, None)
+
+    def invalidate_channel(self, channel):
+        server = getattr(channel, "server", None)
+        channels = None if server is None else self.permissions.get(server.id)
+        if channels is not None:
+            channels.pop(channel.id, None)
@@ -1,27 +1,32 @@
-import json
 import re
 import time
 from datetime import datetime
 
-import requests
 from discord import Embed
 
+from . import resilience, web
+
+# Channels go live and offline, so the cached status is only briefly trusted
+upstream = resilience.Upstream("picarto", deadline=5, fresh_ttl=10, stale_ttl=20)
+
 
 class Channel(object):
 
-    regex = re.compile("((http[s]?):\/\/)?(www\.)?(picarto.tv)\/(\w*)\/?", re.IGNORECASE)
+    # The group name is unique among the links the scanner recognizes, which combines it with theirs
+    regex = re.compile(r"(?:https?://)?(?:www\.)?picarto\.tv/(?P<picarto>\w*)/?", re.IGNORECASE)
 
     def __init__(self, *, url=None, name=None):
         if url is not None:
-            url_format = re.compile("((http[s]?):\/\/)?(www\.)?(picarto.tv)\/(\w*)\/?", re.IGNORECASE)
-            link = url_format.search(url)
-            self.name = link.group(5)
+            link = self.regex.search(url)
+            self.name = link.group("picarto")
             self.url = url
         else:
             self.name = name
             self.url = "https://picarto.tv/{}".format(self.name)
-        get = requests.get("https://api.picarto.tv/v1/channel/name/{}".format(self.name)).text
-        channel_info = json.loads(get)
+
+    async def fetch(self):
+        url = "https://api.picarto.tv/v1/channel/name/{}".format(self.name)
+        channel_info = await upstream.call(self.name.lower(), lambda: web.client.get_json(url))
         self.name = channel_info.get("name")
         self.viewers = channel_info.get("viewers")
         self.category = channel_info.get("category")
@@ -36,19 +41,9 @@ class Channel(object):
             self.adult = "NSFW"
         else:
             self.adult = "SFW"
-
-    def _update_status(self):
-        get = requests.get("https://api.picarto.tv/v1/channel/name/{}".format(self.name)).text
-        channel_info = json.loads(get)
-        if channel_info.get("online"):
-            self.status = "Online"
-            self.color = 0x10FF00
-        else:
-            self.status = "Offline"
-            self.color = 0xFF0000
+        return self
 
     def get_embed(self):
-        self._update_status()
         embed = Embed(
             title=self.name,
             description="{}\n"
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime
+
+from discord import Embed
+
+from . import web
+from .orchestrators.dispatch import EMBED_CHARACTERS, EMBED_FIELDS, FIELD_NAME, FIELD_VALUE
+
+
+class QuickViewResolver(object):
+    """Resolves the links of a single message concurrently.
+
+    Links are deduplicated, at most fan_out lookups run at once per message and results keep the order the links
+    were posted in. Link dumps can be merged into a few summary embeds instead of one reply per link.
+    """
+
+    __slots__ = ["fan_out", "merge_threshold"]
+
+    def __init__(self, *, fan_out=4, merge_threshold=3):
+        self.fan_out = fan_out
+        self.merge_threshold = merge_threshold
+
+    async def resolve(self, keys, fetch, *, errors=(ValueError, web.WebError)):
+        unique = list(dict.fromkeys(keys))
+        semaphore = asyncio.Semaphore(self.fan_out)
+
+        async def bounded(key):
+            async with semaphore:
+                try:
+                    return await fetch(key)
+                except errors:
+                    return None
+
+        results = await asyncio.gather(*[bounded(key) for key in unique])
+        return [result for result in results if result is not None]
+
+    def merge(self, embeds, *, footer):
+        if len(embeds) < self.merge_threshold:
+            return embeds
+        # Chunks are split on the field count and on the characters the fields, title and footer add up to
+        chunks = [[]]
+        budget = EMBED_CHARACTERS - len(footer) - len("{} links".format(EMBED_FIELDS))
+        size = 0
+        for item in embeds:
+            name = (item.title or "Untitled")[:FIELD_NAME]
+            value = "[Link]({})\n{}".format(item.url, item.description or "")[:FIELD_VALUE]
+            if chunks[-1] and (len(chunks[-1]) == EMBED_FIELDS or size + len(name) + len(value) > budget):
+                chunks.append([])
+                size = 0
+            chunks[-1].append((item.color, name, value))
+            size += len(name) + len(value)
+        merged = []
+        for chunk in chunks:
+            embed = Embed(title="{} links".format(len(chunk)), color=chunk[0][0], timestamp=datetime.now())
+            for _, name, value in chunk:
+                embed.add_field(name=name, value=value, inline=False)
+            embed.set_footer(text=footer)
+            merged.append(embed)
+        return merged
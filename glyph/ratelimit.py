@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter(object):
+    """Token buckets keyed by ID.
+
+    Each bucket is a (tokens, last update, warned) tuple kept in least recently used order. Buckets idle long enough
+    to have refilled are indistinguishable from new ones, so they are evicted and memory is bounded by active keys.
+    """
+
+    __slots__ = ["rate", "capacity", "ttl", "max_entries", "buckets"]
+
+    def __init__(self, *, rate, capacity, max_entries=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.ttl = capacity / rate
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def acquire(self, key, *, now=None):
+        """Takes a token, returning how long to wait for one and whether this is the first refusal in a row."""
+        if now is None:
+            now = time.monotonic()
+        self._evict(now)
+        tokens, updated, warned = self.buckets.pop(key, (self.capacity, now, False))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self.buckets[key] = (tokens - 1, now, False)
+            return 0, False
+        self.buckets[key] = (tokens, now, True)
+        return (1 - tokens) / self.rate, not warned
+
+    def refund(self, key):
+        """Gives back a token taken by acquire, for a call that didn't go ahead after all."""
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            self.buckets[key] = (min(self.capacity, bucket[0] + 1),) + bucket[1:]
+
+    def _evict(self, now):
+        buckets = self.buckets
+        while buckets:
+            key, (tokens, updated, warned) = next(iter(buckets.items()))
+            if now - updated < self.ttl and len(buckets) < self.max_entries:
+                break
+            buckets.popitem(last=False)
+
+
+class MessageLimiter(object):
+    """Limits how often users, and whole servers, can have the bot process their messages."""
+
+    __slots__ = ["users", "servers"]
+
+    def __init__(self, *, user_rate=0.25, user_burst=3, server_rate=1, server_burst=20):
+        self.users = TokenBucketLimiter(rate=user_rate, capacity=user_burst)
+        self.servers = TokenBucketLimiter(rate=server_rate, capacity=server_burst)
+
+    def acquire(self, user_id, server_id=None):
+        wait, warn = self.users.acquire(user_id)
+        if wait or server_id is None:
+            return wait, warn
+        wait, warn = self.servers.acquire(server_id)
+        if wait:  # The user isn't charged for a message the server's limit refused
+            self.users.refund(user_id)
+        return wait, warn
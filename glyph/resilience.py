@@ -0,0 +1,274 @@
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import web
+
+upstreams = {}  # Name to Upstream, for reporting
+
+
+class DeadlineExceeded(web.WebError):
+    """Raised when an upstream call, including its retries and hedges, runs out of time."""
+
+
+class CircuitBreaker(object):
+    """Stops calls to an upstream that keeps failing or answering slowly.
+
+    The circuit opens after a number of consecutive failures, where responses slower than the latency limit count as
+    failures too. While open, calls are refused without being attempted. Once the reset timeout has passed a single
+    trial call is let through, which closes the circuit again on success or reopens it on failure.
+    """
+
+    __slots__ = ["failure_threshold", "latency_limit", "reset_timeout", "failures", "opened", "_trial"]
+
+    def __init__(self, *, failure_threshold=5, latency_limit=None, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.latency_limit = latency_limit
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None  # When the circuit opened, None while closed
+        self._trial = False
+
+    @property
+    def is_open(self):
+        return self.opened is not None
+
+    def allow(self, *, now=None):
+        if self.opened is None:
+            return True
+        if self._trial or (now or time.monotonic()) - self.opened < self.reset_timeout:
+            return False
+        self._trial = True
+        return True
+
+    def success(self, latency=0, *, now=None):
+        if self.latency_limit is not None and latency > self.latency_limit:
+            self.failure(now=now)
+            return
+        self.failures = 0
+        self.opened = None
+        self._trial = False
+
+    def failure(self, *, now=None):
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            self.opened = now or time.monotonic()
+        self._trial = False
+
+
+class LatencyHistogram(object):
+    """Latencies counted in fixed buckets, and errors counted by type.
+
+    Counts are halved every decay_every observations, so percentiles follow recent behaviour of the upstream.
+    """
+
+    __slots__ = ["counts", "errors", "total", "decay_every", "_observed"]
+
+    bounds = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, *, decay_every=1000):
+        self.counts = [0] * (len(self.bounds) + 1)  # The last bucket is everything slower than the last bound
+        self.errors = {}
+        self.total = 0
+        self.decay_every = decay_every
+        self._observed = 0
+
+    def observe(self, latency):
+        bucket = 0
+        while bucket < len(self.bounds) and latency > self.bounds[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.total += 1
+        self._observed += 1
+        if self._observed >= self.decay_every:
+            self._observed = 0
+            self.counts = [count // 2 for count in self.counts]
+            self.total = sum(self.counts)
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def percentile(self, fraction):
+        """Estimates a latency percentile by interpolating within its bucket, None without observations."""
+        if not self.total:
+            return None
+        rank = fraction * self.total
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[bucket - 1] if bucket else 0
+                upper = self.bounds[bucket] if bucket < len(self.bounds) else self.bounds[-1] * 2
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+
+class RetryBudget(object):
+    """Allows retries and hedges only up to a ratio of the calls made, so a failing upstream isn't hammered."""
+
+    __slots__ = ["ratio", "capacity", "tokens"]
+
+    def __init__(self, *, ratio=0.2, capacity=10):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+
+    def deposit(self):
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self):
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Upstream(object):
+    """The call policy of a single third party service.
+
+    Every call has a deadline covering its retries. Failed calls are retried while the retry budget allows, and once
+    an attempt takes longer than the upstream's recent 95th percentile latency a second, hedged attempt is started,
+    whichever answers first wins. Calls with a key are cached, and while a result is stale but not expired it is
+    returned right away and refreshed in the background.
+
+    Blocking calls run on the upstream's own few threads, since a thread can't be cancelled once it hangs on a dead
+    service, and would otherwise use up the loop's default executor.
+    """
+
+    __slots__ = ["name", "deadline", "retries", "hedge", "retry_on", "fresh_ttl", "stale_ttl", "max_entries",
+                 "workers", "histogram", "budget", "cache", "stats", "_refreshing", "_executor"]
+
+    min_samples = 20  # Observations needed before the percentile is trusted for hedging
+
+    def __init__(self, name, *, deadline=5, retries=1, hedge=True, retry_on=(web.WebError, OSError), fresh_ttl=0,
+                 stale_ttl=0, max_entries=1000, workers=2):
+        self.name = name
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge = hedge
+        self.retry_on = retry_on
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.workers = workers
+        self.histogram = LatencyHistogram()
+        self.budget = RetryBudget()
+        self.cache = OrderedDict()  # Key to (fetched, result) in least recently used order
+        self.stats = {"calls": 0, "hits": 0, "stale": 0, "retries": 0, "hedges": 0, "deadlines": 0}
+        self._refreshing = set()
+        self._executor = None
+        upstreams[name] = self
+
+    async def call(self, key, func, *, idempotent=True, hedge=True):
+        """Returns the result of awaiting func(), cached by key unless it is None.
+
+        Calls that aren't idempotent, such as creating a paste, are neither retried nor hedged.
+        """
+        if key is not None and self.fresh_ttl:
+            entry = self.cache.get(key)
+            if entry is not None:
+                age = time.monotonic() - entry[0]
+                if age < self.fresh_ttl + self.stale_ttl:
+                    self.cache.move_to_end(key)
+                    if age < self.fresh_ttl:
+                        self.stats["hits"] += 1
+                    else:
+                        self.stats["stale"] += 1
+                        if key not in self._refreshing:
+                            self._refreshing.add(key)
+                            asyncio.ensure_future(self._refresh(key, func, hedge))
+                    return entry[1]
+        result = await self._call(func, idempotent, hedge)
+        if key is not None and self.fresh_ttl:
+            self._store(key, result)
+        return result
+
+    async def run(self, key, func, *args, idempotent=True):
+        """Like call, for a blocking func which is run on the upstream's threads. These calls are never hedged."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_event_loop()
+        return await self.call(key, lambda: loop.run_in_executor(self._executor, func, *args), idempotent=idempotent,
+                               hedge=False)
+
+    def _store(self, key, result):
+        self.cache.pop(key, None)
+        self.cache[key] = (time.monotonic(), result)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+    async def _refresh(self, key, func, hedge):
+        try:
+            self._store(key, await self._call(func, True, hedge))
+        except Exception:
+            pass  # Already counted, the stale result is served until it expires
+        finally:
+            self._refreshing.discard(key)
+
+    def _retryable(self, error):
+        if not isinstance(error, self.retry_on) or isinstance(error, DeadlineExceeded):
+            return False
+        # Client errors won't go away by asking again, except for being ratelimited
+        status = getattr(error, "status", None)
+        return status is None or status >= 500 or status == 429
+
+    async def _call(self, func, idempotent, hedge):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.deadline
+        self.stats["calls"] += 1
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged(func, deadline, idempotent and hedge and self.hedge)
+            except Exception as e:
+                if not idempotent or attempt >= self.retries or not self._retryable(e) or \
+                        loop.time() >= deadline or not self.budget.withdraw():
+                    raise
+            attempt += 1
+            self.stats["retries"] += 1
+
+    async def _attempt(self, func):
+        start = time.monotonic()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.histogram.error(type(e).__name__)
+            raise
+        self.histogram.observe(time.monotonic() - start)
+        return result
+
+    async def _hedged(self, func, deadline, hedge):
+        loop = asyncio.get_event_loop()
+        tasks = [asyncio.ensure_future(self._attempt(func))]
+        try:
+            delay = self.histogram.percentile(0.95) if hedge and self.histogram.total >= self.min_samples else None
+            if delay is not None and loop.time() + delay < deadline:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.budget.withdraw():
+                    self.stats["hedges"] += 1
+                    tasks.append(asyncio.ensure_future(self._attempt(func)))
+            error = None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, timeout=max(deadline - loop.time(), 0),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.stats["deadlines"] += 1
+                    self.histogram.error(DeadlineExceeded.__name__)
+                    raise DeadlineExceeded("{} didn't answer within {}s".format(self.name, self.deadline))
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def summary(self):
+        return {"p50": self.histogram.percentile(0.5), "p95": self.histogram.percentile(0.95),
+                "p99": self.histogram.percentile(0.99), "errors": dict(self.histogram.errors), **self.stats}
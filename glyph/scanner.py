@@ -0,0 +1,46 @@
+import re
+
+from . import fa, picarto
+
+
+class ScanResult(object):
+
+    __slots__ = ["content", "fa_ids", "picarto_names", "mentioned", "text"]
+
+    def __init__(self, content, fa_ids, picarto_names, mentioned, text):
+        self.content = content
+        self.fa_ids = fa_ids
+        self.picarto_names = picarto_names
+        self.mentioned = mentioned
+        self.text = text
+
+
+class MessageScanner(object):
+    """Tokenizes a message once, picking out FA submissions and Picarto channels in a single pass.
+
+    Plain words are matched only to step over them, so links are only recognized where a token starts.
+    """
+
+    __slots__ = []
+
+    pattern = re.compile("|".join([fa.Submission.regex.pattern, picarto.Channel.regex.pattern, r"(?P<word>[\w']+)"]),
+                         re.IGNORECASE)
+
+    def scan(self, content, *, mention=None):
+        fa_ids = []
+        picarto_names = []
+        for match in self.pattern.finditer(content):
+            kind = match.lastgroup
+            if kind == "fa_id":
+                if match.group("fa_type").lower() == "view":
+                    fa_ids.append(match.group("fa_id"))
+            elif kind == "picarto":
+                if match.group("picarto"):
+                    picarto_names.append(match.group("picarto"))
+        mentioned = False
+        text = content
+        if mention is not None:
+            mention = "@{}".format(mention)
+            mentioned = content.startswith(mention)
+            text = content.replace(mention, "")
+        return ScanResult(content, fa_ids, picarto_names, mentioned, text.strip())
@@ -1,159 +1,539 @@
+import asyncio
 import json
+import logging
+import threading
+import time
 import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extras import RealDictCursor, execute_values
 
-from . import hastebin
+from . import hastebin, web
+from .guildconfig import GuildConfig
+from .snapshot import ConfigSnapshot
+
+log = logging.getLogger(__name__)
+
+_missing = object()  # A guild that wasn't cached before a write
+
+_columns = "guild_id, wiki, selectable_roles, spoilers_channel, spoilers_keywords, fa_quickview_enabled, " \
+           "fa_quickview_thumbnail, picarto_quickview_enabled, auditing_channel, auditing_joins, auditing_leaves, " \
+           "auditing_reactions"
+
+_on_conflict = " ON CONFLICT (guild_id) DO UPDATE SET" \
+               " (wiki, selectable_roles, spoilers_channel, spoilers_keywords," \
+               " fa_quickview_enabled, fa_quickview_thumbnail, picarto_quickview_enabled, " \
+               " auditing_channel, auditing_joins, auditing_leaves, auditing_reactions)" \
+               " = (EXCLUDED.wiki, EXCLUDED.selectable_roles, EXCLUDED.spoilers_channel, " \
+               " EXCLUDED.spoilers_keywords, EXCLUDED.fa_quickview_enabled, " \
+               " EXCLUDED.fa_quickview_thumbnail, EXCLUDED.picarto_quickview_enabled, " \
+               " EXCLUDED.auditing_channel, EXCLUDED.auditing_joins, EXCLUDED.auditing_leaves, " \
+               " EXCLUDED.auditing_reactions)"
+
+# Only with a snapshot are rows tracked by when they last changed, the column is added when missing
+_migrate_snapshot = "ALTER TABLE serverconfigs ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now()"
+_touch = ", updated_at = now()"
+
+_statements = {
+    "select_all": "SELECT {} FROM serverconfigs".format(_columns),
+    "select": "SELECT {} FROM serverconfigs WHERE guild_id = $1".format(_columns),
+    "select_many": "SELECT {} FROM serverconfigs WHERE guild_id = ANY($1)".format(_columns),
+    "upsert": "INSERT INTO serverconfigs ({}) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)".format(
+        _columns) + _on_conflict,
+    "delete": "DELETE FROM serverconfigs WHERE guild_id = $1"
+}
+
+_snapshot_statements = dict(_statements, **{
+    "upsert": _statements["upsert"] + _touch,
+    "select_changed": "SELECT {}, extract(epoch FROM updated_at)::float8 AS updated_at FROM serverconfigs "
+                      "WHERE updated_at > to_timestamp($1)".format(_columns),
+    "select_ids": "SELECT guild_id FROM serverconfigs"
+})
+
+_batch_upsert = "INSERT INTO serverconfigs ({}) VALUES %s".format(_columns) + _on_conflict
+_batch_delete = "DELETE FROM serverconfigs WHERE guild_id = ANY(%s)"
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """A connection that remembers whether the config statements were prepared on it.
+
+    Pools handed to ConfigDatabase, such as one pointed at a local test database, must use it as connection_factory.
+    """
+
+    prepared = False
 
 
 class ConfigDatabase(object):
 
-    __slots__ = ["url", "conn", "cur", "configs"]
+    __slots__ = ["url", "pool", "min_connections", "max_connections", "executor", "capacity", "configs",
+                 "flush_delay", "batch_size", "flush_stats", "snapshot_path", "snapshot", "reconcile_interval",
+                 "statements", "batch_upsert", "_pool_lock", "_loading", "_failed", "_pending", "_waiters",
+                 "_flush_task", "_flush_lock", "_retries", "_migrated", "_stale", "_reconcile_task", "_reconcile_lock"]
 
-    def __init__(self, url):
+    failure_ttl = 5  # Seconds a guild whose config failed to load is served the default one before trying again
+    max_flush_delay = 60  # Longest backoff between retries of writes that failed on a broken connection
+    reconcile_overlap = 60  # Seconds of changes read again, for rows committed after others with a later updated_at
+
+    def __init__(self, url, *, min_connections=1, max_connections=5, pool=None, capacity=10000, flush_delay=1,
+                 batch_size=500, snapshot_path=None, reconcile_interval=900):
         urllib.parse.uses_netloc.append("postgres")
         self.url = urllib.parse.urlparse(url)
-        self.conn = None
-        self.cur = None
-        self.configs = {}
-
-    def open(self):
-        self.conn = psycopg2.connect(
-            database=self.url.path[1:],
-            user=self.url.username,
-            password=self.url.password,
-            host=self.url.hostname,
-            port=self.url.port
-        )
-        self.cur = self.conn.cursor(cursor_factory=RealDictCursor)
-
-    def load_all(self):
-        self.open()
+        self.pool = pool
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.executor = ThreadPoolExecutor(max_workers=max_connections)
+        self.capacity = capacity
+        self.configs = OrderedDict()  # Guild ID to config in least recently used order, None if it has none
+        self.flush_delay = flush_delay
+        self.batch_size = batch_size
+        self.flush_stats = {"flushes": 0, "upserts": 0, "deletes": 0, "failures": 0, "last_duration": 0}
+        self.snapshot_path = snapshot_path
+        self.snapshot = None
+        self.reconcile_interval = reconcile_interval
+        self.statements = _statements if snapshot_path is None else _snapshot_statements
+        self.batch_upsert = _batch_upsert if snapshot_path is None else _batch_upsert + _touch
+        self._migrated = snapshot_path is None
+        self._pool_lock = threading.Lock()  # The pool is created on whichever database thread needs it first
+        self._loading = {}  # Guild ID to the future of its pending load
+        self._failed = {}  # Guild ID to when loading its config last failed
+        # Guild ID to the (parameters, config, previous entry) to write, with None parameters and config to delete
+        self._pending = OrderedDict()
+        self._waiters = {}  # Guild ID to the futures waiting for its write
+        self._flush_task = None
+        self._flush_lock = None
+        self._retries = 0
+        self._stale = {}  # Guild ID to when it was last written, its snapshot record is outdated since
+        self._reconcile_task = None
+        self._reconcile_lock = None
+
+    def _get_pool(self):
+        if self.pool is None:
+            with self._pool_lock:
+                if self.pool is None:
+                    self.pool = psycopg2.pool.ThreadedConnectionPool(
+                        self.min_connections, self.max_connections,
+                        database=self.url.path[1:],
+                        user=self.url.username,
+                        password=self.url.password,
+                        host=self.url.hostname,
+                        port=self.url.port,
+                        connection_factory=PreparedConnection
+                    )
+        return self.pool
+
+    def _prepare(self, conn):
+        if conn.prepared:
+            return
+        with conn.cursor() as cur:
+            if not self._migrated:
+                cur.execute(_migrate_snapshot)
+                self._migrated = True
+            for name, statement in self.statements.items():
+                cur.execute("PREPARE config_{} AS {}".format(name, statement))
+        conn.commit()
+        conn.prepared = True
+
+    def _run(self, operation, *, retries=1):
+        """Runs operation with a pooled cursor and commits, replacing connections that turn out to be broken."""
+        pool = self._get_pool()
+        for attempt in range(retries + 1):
+            conn = pool.getconn()
+            if conn.closed:
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
+            try:
+                self._prepare(conn)
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    result = operation(cur)
+                conn.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                pool.putconn(conn, close=True)
+                if attempt == retries:
+                    raise
+            except Exception:
+                conn.rollback()
+                pool.putconn(conn)
+                raise
+            else:
+                pool.putconn(conn)
+                return result
+
+    async def _execute(self, operation):
+        """Runs operation on the database threads, keeping blocking I/O off the event loop."""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self._run, operation)
+
+    async def load_all(self):
+        def select_all(cur):
+            cur.execute("EXECUTE config_select_all")
+            return cur.fetchall()
+        rows = await self._execute(select_all)
         self.configs.clear()
-        self.cur.execute("SELECT guild_id, wiki, selectable_roles, spoilers_channel, spoilers_keywords,"
-                         " fa_quickview_enabled, fa_quickview_thumbnail, picarto_quickview_enabled, auditing_channel, "
-                         "auditing_joins, auditing_leaves, auditing_reactions FROM serverconfigs")
-        rows = self.cur.fetchall()
         for row in rows:
             guild_id = row.get("guild_id")
             row.pop("guild_id")
-            self.configs.update({guild_id: self._pretty_print(row)})
-        self.close()
-
-    def load(self, guild_id):
-        self.open()
-        self.cur.execute("SELECT guild_id, wiki, selectable_roles, spoilers_channel, spoilers_keywords,"
-                         " fa_quickview_enabled, fa_quickview_thumbnail, picarto_quickview_enabled, auditing_channel, "
-                         "auditing_joins, auditing_leaves, auditing_reactions FROM serverconfigs "
-                         "WHERE guild_id = (%s)", [guild_id])
-        row = self.cur.fetchone()
-        guild_id = row.get("guild_id")
-        self.configs.update({guild_id: self._pretty_print(row)})
-        self.close()
+            self._store(guild_id, GuildConfig.from_row(row))
+
+    async def load(self, guild_id):
+        def select(cur):
+            cur.execute("EXECUTE config_select (%s)", [guild_id])
+            return cur.fetchone()
+        row = await self._execute(select)
+        guild_id = int(guild_id)
+        config = None if row is None else GuildConfig.from_row(row)
+        if guild_id in self._pending:  # A write that hasn't been flushed yet is newer than the row
+            config = self._pending[guild_id][1]
+        self._store(guild_id, config)
+        return config
+
+    async def prefetch(self, guild_ids):
+        """Loads the configs of many guilds in a single query, e.g. for the busiest guilds after startup."""
+        guild_ids = [int(guild_id) for guild_id in guild_ids
+                     if int(guild_id) not in self.configs and not self._from_snapshot(int(guild_id))]
+        if not guild_ids:
+            return
+
+        def select_many(cur):
+            cur.execute("EXECUTE config_select_many (%s)", [guild_ids])
+            return cur.fetchall()
+        try:
+            rows = await self._execute(select_many)
+        except psycopg2.Error as e:
+            log.warning("Failed to prefetch {} configuration(s): {}".format(len(guild_ids), e))
+            failed = time.monotonic()
+            self._failed.update((guild_id, failed) for guild_id in guild_ids)
+            return
+        found = set()
+        for row in rows:
+            guild_id = row.pop("guild_id")
+            found.add(guild_id)
+            self._store(guild_id, GuildConfig.from_row(row))
+        for guild_id in guild_ids:
+            if guild_id not in found:
+                self._store(guild_id, None)
+
+    async def fetch(self, server):
+        """Returns the config of a server, loading it on first access. Concurrent loads of a guild share one query."""
+        guild_id = self._key(server)
+        if guild_id is None or guild_id in self.configs or self._from_snapshot(guild_id) or self._failing(guild_id):
+            return self.get(server)
+        future = self._loading.get(guild_id)
+        if future is None:
+            future = asyncio.ensure_future(self.load(guild_id))
+            self._loading[guild_id] = future
+            future.add_done_callback(lambda _: self._loaded(guild_id, future))
+        try:
+            await asyncio.shield(future)
+        except psycopg2.Error:
+            pass  # Recorded by _loaded, the default config is served until the failure expires
+        return self.get(server)
+
+    def _loaded(self, guild_id, future):
+        self._loading.pop(guild_id, None)
+        if not future.cancelled() and isinstance(future.exception(), psycopg2.Error):
+            self._failed[guild_id] = time.monotonic()
+        else:
+            self._failed.pop(guild_id, None)
+
+    def _failing(self, guild_id):
+        """Whether loading the guild's config failed recently, so it isn't queried again on every event."""
+        failed = self._failed.get(guild_id)
+        if failed is None:
+            return False
+        if time.monotonic() - failed < self.failure_ttl:
+            return True
+        del self._failed[guild_id]
+        return False
+
+    def _store(self, guild_id, config):
+        self._failed.pop(guild_id, None)
+        if config is not None:
+            config.reuse_spoilers(self.configs.get(guild_id))
+        self.configs[guild_id] = config
+        self.configs.move_to_end(guild_id)
+        while len(self.configs) > self.capacity:
+            evicted, evicted_config = self.configs.popitem(last=False)
+            if evicted == 0:  # The default config is never evicted
+                self.configs[0] = evicted_config
 
     @staticmethod
-    def _pretty_print(config):
-        pretty_config = {
-            "roles": {
-              "selectable": config["selectable_roles"]
-            },
-            "quickview": {
-              "fa": {
-                "enabled": config["fa_quickview_enabled"],
-                "thumbnail": config["fa_quickview_thumbnail"]
-              },
-              "picarto": {
-                "enabled": config["picarto_quickview_enabled"]
-              }
-            },
-            "spoilers": {
-              "safe_channel": config["spoilers_channel"],
-              "keywords": config["spoilers_keywords"]
-            },
-            "auditing": {
-              "channel": config["auditing_channel"],
-              "joins": config["auditing_joins"],
-              "leaves": config["auditing_leaves"],
-              "reactions": config["auditing_reactions"]
-            },
-            "wiki": config["wiki"]
-        }
-        return pretty_config
-
-    def delete(self, guild_id):
-        self.open()
-        self.cur.execute("DELETE FROM serverconfigs WHERE guild_id = (%s)", [guild_id])
-        self.conn.commit()
+    def _key(server):
         try:
-            self.configs.pop(guild_id)
-        except KeyError:
-            pass
-        self.close()
+            return int(server.id)
+        except AttributeError:
+            return None
+
+    async def delete(self, guild_id):
+        previous = self.configs.pop(int(guild_id), _missing)
+        self._enqueue(int(guild_id), None, None, previous)
 
     def get(self, server):
+        """Returns the cached config of a server, or the default one while it is not loaded yet."""
         config = self.configs.get(0)
-        try:
-            if self.configs.get(int(server.id)) is not None:
-                config = self.configs.get(int(server.id))
-        except AttributeError:
-            pass
+        guild_id = self._key(server)
+        if guild_id is None:
+            return config
+        if guild_id in self.configs:
+            self.configs.move_to_end(guild_id)
+            if self.configs[guild_id] is not None:
+                config = self.configs[guild_id]
+        elif self._from_snapshot(guild_id):
+            config = self.configs[guild_id] or config
+        elif guild_id not in self._loading and not self._failing(guild_id):
+            asyncio.ensure_future(self.fetch(server))
         return config
 
-    def update(self, server, config):
-        self.open()
-        try:
-            self.cur.execute("INSERT INTO serverconfigs"
-                             " (guild_id, wiki, selectable_roles, spoilers_channel, spoilers_keywords,"
-                             " fa_quickview_enabled, fa_quickview_thumbnail, picarto_quickview_enabled, "
-                             " auditing_channel, auditing_joins, auditing_leaves, auditing_reactions)"
-                             " VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-                             " ON CONFLICT (guild_id) DO UPDATE SET"
-                             " (wiki, selectable_roles, spoilers_channel, spoilers_keywords,"
-                             " fa_quickview_enabled, fa_quickview_thumbnail, picarto_quickview_enabled, "
-                             " auditing_channel, auditing_joins, auditing_leaves, auditing_reactions)"
-                             " = (EXCLUDED.wiki, EXCLUDED.selectable_roles, EXCLUDED.spoilers_channel, "
-                             " EXCLUDED.spoilers_keywords, EXCLUDED.fa_quickview_enabled, "
-                             " EXCLUDED.fa_quickview_thumbnail, EXCLUDED.picarto_quickview_enabled, "
-                             " EXCLUDED.auditing_channel, EXCLUDED.auditing_joins, EXCLUDED.auditing_leaves, "
-                             " EXCLUDED.auditing_reactions)",
-                             [server.id,
-                              config["wiki"],
-                              config["roles"]["selectable"],
-                              config["spoilers"]["safe_channel"],
-                              config["spoilers"]["keywords"],
-                              config["quickview"]["fa"]["enabled"],
-                              config["quickview"]["fa"]["thumbnail"],
-                              config["quickview"]["picarto"]["enabled"],
-                              config["auditing"]["channel"],
-                              config["auditing"]["joins"],
-                              config["auditing"]["leaves"],
-                              config["auditing"]["reactions"]])
-            self.conn.commit()
-        except psycopg2.Error as e:
-            self.close()
-            return "{}: {}".format(e.diag.severity, e.diag.message_primary)
-        else:
-            self.configs.update({int(server.id): config})
-            self.close()
-            return "Success!"
+    async def update(self, server, config, *, wait=False):
+        """Updates a server's config right away in memory and queues the database write.
+
+        With wait, the write is flushed and its error, if any, is returned. A write that fails for good puts back the
+        config the server had before.
+        """
+        guild_id = int(server.id)
+        parameters = config.to_parameters(guild_id)
+        previous = self.configs.get(guild_id, _missing)
+        self._store(guild_id, config)
+        future = self._enqueue(guild_id, parameters, config, previous, wait=wait)
+        if future is not None:
+            try:
+                await future
+            except psycopg2.Error as e:
+                return "{}: {}".format(e.diag.severity, e.diag.message_primary)
+        return "Success!"
+
+    def _enqueue(self, guild_id, parameters, config, previous, *, wait=False):
+        # Repeated writes to a guild are merged, only the last one is flushed and the first previous entry is kept
+        merged = self._pending.pop(guild_id, None)
+        if merged is not None:
+            previous = merged[2]
+        self._pending[guild_id] = (parameters, config, previous)
+        self._stale[guild_id] = time.monotonic()
+        future = None
+        if wait:
+            future = asyncio.get_event_loop().create_future()
+            self._waiters.setdefault(guild_id, []).append(future)
+        if wait or len(self._pending) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+        return future
+
+    async def _flush_later(self, delay=None):
+        await asyncio.sleep(self.flush_delay if delay is None else delay)
+        await self.flush()
+
+    async def flush(self):
+        """Writes all queued updates and deletes in one transaction.
+
+        If the batch fails on a bad row, each guild is written on its own, so only the guilds at fault fail. Writes that
+        failed on a broken connection and that nobody waits for are queued again and retried with backoff.
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, OrderedDict()
+            waiters, self._waiters = self._waiters, {}
+            start = time.monotonic()
+            failed = {}
+            cancelled = None
+            try:
+                await self._execute(lambda cur: self._write(cur, pending))
+            except (Exception, asyncio.CancelledError) as e:
+                # Whatever went wrong, the batch is failed or queued again and every waiter is told
+                self.flush_stats["failures"] += 1
+                log.warning("Failed to flush {} configuration writes: {!r}".format(len(pending), e))
+                if isinstance(e, asyncio.CancelledError):
+                    cancelled = e
+                if isinstance(e, psycopg2.Error) and not self._is_transient(e) and len(pending) > 1:
+                    failed = await self._isolate(pending)
+                else:
+                    failed = {guild_id: e for guild_id in pending}
+            self._requeue(pending, waiters, failed)
+            if len(failed) < len(pending):
+                self.flush_stats["flushes"] += 1
+            self.flush_stats["upserts"] += sum(1 for guild_id, write in pending.items()
+                                               if write[0] is not None and guild_id not in failed)
+            self.flush_stats["deletes"] += sum(1 for guild_id, write in pending.items()
+                                               if write[0] is None and guild_id not in failed)
+            self.flush_stats["last_duration"] = time.monotonic() - start
+            for guild_id, futures in waiters.items():
+                for waiter in futures:
+                    if waiter.done():
+                        continue
+                    if guild_id in failed:
+                        waiter.set_exception(failed[guild_id])
+                    else:
+                        waiter.set_result(None)
+            if cancelled is not None:
+                raise cancelled
+
+    @staticmethod
+    def _is_transient(error):
+        return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+    async def _isolate(self, pending):
+        # Writes every guild in its own transaction, returning the errors of those that failed
+        failed = {}
+        for guild_id, write in pending.items():
+            try:
+                await self._execute(lambda cur, single={guild_id: write}: self._write(cur, single))
+            except psycopg2.Error as e:
+                log.warning("Failed to write the configuration of guild {}: {}".format(guild_id, e))
+                failed[guild_id] = e
+        return failed
 
-    def outhaste(self, server):
+    def _requeue(self, pending, waiters, failed):
+        retry = False
+        for guild_id, error in failed.items():
+            previous = pending[guild_id][2]
+            if guild_id in self._pending:
+                # A newer write supersedes the failed one, but should it fail too the entry from before both is due
+                self._pending[guild_id] = self._pending[guild_id][:2] + (previous,)
+            elif guild_id in waiters or not self._is_transient(error):
+                # Not retried, a waiter is told about the failure instead, so the memory matches the database again
+                if previous is _missing:
+                    self.configs.pop(guild_id, None)
+                else:
+                    self._store(guild_id, previous)
+            else:
+                self._pending[guild_id] = pending[guild_id]
+                retry = True
+        if retry:
+            self._retries += 1
+            delay = min(self.flush_delay * 2 ** self._retries, self.max_flush_delay)
+            # Scheduled anew, as this may be running in the current flush task
+            self._flush_task = asyncio.ensure_future(self._flush_later(delay))
+        elif not failed:
+            self._retries = 0
+
+    def _write(self, cur, pending):
+        upserts = [write[0] for write in pending.values() if write[0] is not None]
+        deletes = [guild_id for guild_id, write in pending.items() if write[0] is None]
+        if len(upserts) == 1:
+            cur.execute("EXECUTE config_upsert ({})".format(", ".join(["%s"] * 12)), upserts[0])
+        elif upserts:
+            execute_values(cur, self.batch_upsert, upserts)
+        if len(deletes) == 1:
+            cur.execute("EXECUTE config_delete (%s)", deletes)
+        elif deletes:
+            cur.execute(_batch_delete, [deletes])
+
+    async def outhaste(self, server):
         try:
-            haste = hastebin.post(json.dumps(self.get(server), sort_keys=True, indent=4))
+            haste = await hastebin.post(json.dumps(self.get(server).to_dict(), sort_keys=True, indent=4))
         except json.JSONDecodeError as e:
             haste = "\n*Error dumping the JSON file. This issue will be investigated.*\n```{}```".format(e)
         return haste
 
-    def inhaste(self, server, haste_key):
+    async def inhaste(self, server, haste_key):
         try:
-            config = json.loads(hastebin.get(haste_key))
-        except json.JSONDecodeError as e:
+            config = GuildConfig.from_dict(json.loads(await hastebin.get(haste_key)))
+        except (json.JSONDecodeError, web.WebError) as e:
             return e
         else:
-            result = self.update(server, config)
+            result = await self.update(server, config, wait=True)
         return result
 
+    def warm_start(self):
+        """Opens the snapshot, from then on configs that aren't cached are read from it instead of the database.
+
+        Returns whether the default config was found in it.
+        """
+        if self.snapshot_path is None:
+            return False
+        if self.snapshot is not None:  # Reconnected, the snapshot is already open
+            return self.configs.get(0) is not None
+        self.snapshot = ConfigSnapshot.open(self.snapshot_path)
+        if self.snapshot is None:
+            log.info("No usable configuration snapshot at {}, starting cold".format(self.snapshot_path))
+            return False
+        log.info("Opened configuration snapshot of {} guilds".format(self.snapshot.count))
+        return self._from_snapshot(0) and self.configs[0] is not None
+
+    def _from_snapshot(self, guild_id):
+        # The snapshot holds every row as of its watermark, so a guild missing from it has no config
+        if self.snapshot is None or guild_id in self._stale or guild_id in self._pending:
+            return False
+        self._store(guild_id, self.snapshot.get(guild_id))
+        return True
+
+    def start(self):
+        if self.snapshot_path is not None and (self._reconcile_task is None or self._reconcile_task.done()):
+            self._reconcile_task = asyncio.ensure_future(self._reconciler())
+
+    async def _reconciler(self):
+        while True:
+            await self.reconcile()
+            await asyncio.sleep(self.reconcile_interval)
+
+    async def reconcile(self):
+        """Applies the rows changed since the snapshot's watermark to it and to the cache, and rewrites it on disk.
+
+        Without a snapshot this reads the whole table once, in the background, and writes the first one.
+        """
+        if self.snapshot_path is None:
+            return
+        if self._reconcile_lock is None:
+            self._reconcile_lock = asyncio.Lock()
+        async with self._reconcile_lock:
+            await self._reconcile()
+
+    async def _reconcile(self):
+        started = time.monotonic()
+        await self.flush()  # Writes queued until now are then part of the changed rows
+        watermark = 0 if self.snapshot is None else self.snapshot.watermark
+
+        def select_changed(cur):
+            cur.execute("EXECUTE config_select_changed (%s)", [max(watermark - self.reconcile_overlap, 0)])
+            changed = cur.fetchall()
+            cur.execute("EXECUTE config_select_ids")
+            return changed, set(row["guild_id"] for row in cur.fetchall())
+        try:
+            changed, guild_ids = await self._execute(select_changed)
+            snapshot = await asyncio.get_event_loop().run_in_executor(
+                self.executor, self._rewrite, self.snapshot, changed, guild_ids, watermark)
+        except (psycopg2.Error, OSError) as e:
+            log.warning("Failed to reconcile the configuration snapshot: {}".format(e))
+            return
+
+        previous, self.snapshot = self.snapshot, snapshot
+        self._stale = {guild_id: written for guild_id, written in self._stale.items() if written >= started}
+        changed = {row["guild_id"]: row for row in changed}
+        for guild_id in list(self.configs):
+            if guild_id in self._stale or guild_id in self._pending:
+                continue
+            if guild_id in changed:
+                self._store(guild_id, GuildConfig.from_row(changed[guild_id]))
+            elif guild_id not in guild_ids and self.configs[guild_id] is not None:
+                self._store(guild_id, None)
+        if previous is not None:
+            previous.close()
+        log.info("Reconciled the configuration snapshot, {} guilds changed in {:.2f}s".format(
+            len(changed), time.monotonic() - started))
+
+    def _rewrite(self, snapshot, changed, guild_ids, watermark):
+        records = {} if snapshot is None else {record[0]: record for record in snapshot.records()}
+        for row in changed:
+            records[row["guild_id"]] = (row["guild_id"], row["updated_at"],
+                                        ConfigSnapshot.encode(GuildConfig.from_row(row)))
+            watermark = max(watermark, row["updated_at"])
+        ConfigSnapshot.write(self.snapshot_path,
+                             [record for guild_id, record in records.items() if guild_id in guild_ids], watermark)
+        return ConfigSnapshot.open(self.snapshot_path)
+
     def close(self):
-        self.cur.close()
-        self.conn.close()
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+            self._reconcile_task = None
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+        self.executor.shutdown(wait=True)
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
@@ -5,6 +5,7 @@ import humanize
 import psutil
 from discord import Embed
 
+from .. import resilience
 from .commander import register
 
 
@@ -48,6 +49,11 @@ async def status(message):
                               "**Disk** {}/{} ({}%)\n**Uptime** {} days".format(
                             memory_used, memory_total, memory_percent, cpu_count, cpu_percent,
                             disk_used, disk_total, disk_percent, uptime.days))
+        upstreams = ["**{}** {:.0f} ms p95, {} errors".format(name, upstream.histogram.percentile(0.95) * 1000,
+                                                               sum(upstream.histogram.errors.values()))
+                     for name, upstream in sorted(resilience.upstreams.items()) if upstream.histogram.total]
+        if upstreams:
+            embed.add_field(name="Upstream Info", value="\n".join(upstreams))
         embed.set_footer(text="Last restarted {}".format(last_restart))
         return embed
 
@@ -110,7 +110,7 @@ async def load_config(message):
     haste_regex = re.compile(r"hastebin.com\/(\w{10})")
     try:
         haste = haste_regex.search(message.ai.get_parameter("url"))
-        result = message.client.configdb.inhaste(message.server, haste.group(1))
+        result = await message.client.configdb.inhaste(message.server, haste.group(1))
         if result == "Success!":
             embed = discord.Embed(title="Configuration Update Success",
                                   description="Successfully updated this servers configuration!",
@@ -141,6 +141,7 @@ async def load_config(message):
 @utils.server_only
 @utils.admin_only
 async def view_config(message):
+    haste = await message.client.configdb.outhaste(message.server)
     embed = discord.Embed(title="Configuration Viewer",
                           description="Here's the current info: {}\n"
                                       "**Help:** "
@@ -148,7 +149,6 @@ async def view_config(message):
                                       "(https://glyph-discord.readthedocs.io"
                                       "/en/latest/configuration.html) "
                                       "- [Official Glyph Server]"
-                                      "(https://discord.me/glyph-discord)".format(
-                                        message.client.configdb.outhaste(message.server)),
+                                      "(https://discord.me/glyph-discord)".format(haste),
                           timestamp=datetime.utcnow())
     await message.reply(embed=embed)
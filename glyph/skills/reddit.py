@@ -6,8 +6,33 @@ import praw
 import prawcore
 from praw import exceptions
 
+from .. import resilience
 from .commander import register
 
+# Not hedged, finding an image is many requests and would skew the latency of the quick ones
+upstream = resilience.Upstream("reddit", deadline=15, hedge=False, fresh_ttl=3600, stale_ttl=86400,
+                               retry_on=(prawcore.exceptions.RequestException, prawcore.exceptions.ServerError))
+
+
+def _over18(r, subreddit):
+    return r.subreddit(subreddit).over18
+
+
+def _find_image(r, multireddit, nswf_channel):
+    # Runs on an executor, every attribute access of a submission may be a blocking request
+    for i in range(1, 20):  # Get an image that can be embedded
+        try:
+            submission = r.subreddit(multireddit).random()
+        except TypeError:
+            continue
+        if submission.over_18 and not nswf_channel:
+            continue
+        elif any(extension in submission.url for extension in [".png", ".jpg", ".jpeg", ".gif"]) \
+                and submission.score > 10:
+            suggestion = r.subreddit("popular").random().subreddit.display_name
+            return submission.title, submission.shortlink, submission.url, str(submission.subreddit), suggestion
+    return None
+
 
 @register("reddit")
 async def send_image(message):
@@ -19,7 +44,7 @@ async def send_image(message):
         await message.reply("I think you wanted an image from Reddit, but I'm not sure of what. Sorry.")
         return
     try:
-        nsfw_subreddit = [s for s in multireddit.split("+") if r.subreddit(s).over18]
+        nsfw_subreddit = [s for s in multireddit.split("+") if await upstream.run(s.lower(), _over18, r, s)]
         try:
             nswf_channel = "nsfw" in message.channel.name
         except TypeError:
@@ -27,21 +52,13 @@ async def send_image(message):
         if nsfw_subreddit and not nswf_channel:
             await message.reply("You must be in a NSFW channel to view images from `{}`".format(multireddit))
             return
-        for i in range(1, 20):  # Get an image that can be embedded
-            try:
-                submission = r.subreddit(multireddit).random()
-            except TypeError:
-                continue
-            if submission.over_18 and not nswf_channel:
-                continue
-            elif any(extension in submission.url for extension in [".png", ".jpg", ".jpeg", ".gif"]) \
-                    and submission.score > 10:
-                embed = discord.Embed(title=submission.title, url=submission.shortlink, timestamp=datetime.utcnow())
-                embed.set_image(url=submission.url)
-                suggestion = r.subreddit("popular").random().subreddit.display_name
-                embed.set_footer(text="r/{} | Try asking \"r/{}\"".format(submission.subreddit, suggestion))
-                await message.reply(embed=embed)
-                break
+        image = await upstream.run(None, _find_image, r, multireddit, nswf_channel)
+        if image is not None:
+            title, shortlink, url, subreddit, suggestion = image
+            embed = discord.Embed(title=title, url=shortlink, timestamp=datetime.utcnow())
+            embed.set_image(url=url)
+            embed.set_footer(text="r/{} | Try asking \"r/{}\"".format(subreddit, suggestion))
+            await message.reply(embed=embed)
         else:
             await message.reply("Sorry, I took too long to try to find an image.")
     except (prawcore.exceptions.NotFound, prawcore.exceptions.Redirect):
@@ -49,5 +66,8 @@ async def send_image(message):
     except prawcore.exceptions.Forbidden:
         await message.reply("Sorry, but `{}` is a private community and so I can not grab a photo from there.".format(
             multireddit))
-    except (praw.exceptions.ClientException, praw.exceptions.APIException):
+    except (praw.exceptions.ClientException, praw.exceptions.APIException, prawcore.exceptions.RequestException,
+            prawcore.exceptions.ServerError):
         await message.reply("Sorry, I had an issue communicating with Reddit.")
+    except resilience.DeadlineExceeded:
+        await message.reply("Sorry, I took too long to try to find an image.")
@@ -10,7 +10,7 @@ from .commander import register
 @register("role.set")
 async def change_role(message):
     desired_role = message.ai.get_parameter("role")
-    selectable_roles = message.config["roles"]["selectable"]
+    selectable_roles = message.config.selectable_roles_lower
     try:
         target_user = message.clean_mentions[0]
     except IndexError:
@@ -25,7 +25,7 @@ async def change_role(message):
         await message.reply("Sorry, I can not seem to find a desired role in your message.")
         return
     # TODO: Check permissions and improve safe remove and add permissions
-    allowed_roles = list(filter(lambda x: x.name.lower() in map(str.lower, selectable_roles), message.server.roles))
+    allowed_roles = list(filter(lambda x: x.name.lower() in selectable_roles, message.server.roles))
     try:
         new_role = list(filter(lambda x: x.name.lower() == desired_role.lower(), message.server.roles))[0]
     except IndexError:
@@ -53,7 +53,7 @@ async def change_role(message):
 
 @register("role.list")
 async def list_roles(message):
-    selectable_roles = message.config["roles"]["selectable"]
+    selectable_roles = message.config.selectable_roles
     if message.channel.is_private:  # You can't list roles, if you're not in a server
         await message.reply("<:xmark:344316007164149770> You must be in a server to list roles.")
         return
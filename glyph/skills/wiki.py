@@ -1,48 +1,89 @@
 from datetime import datetime
 
+import requests
 import wikia
 import wikipedia
 from discord import Embed
 
+from .. import resilience
 from .commander import register
 
+wikipedia_upstream = resilience.Upstream("wikipedia", deadline=10, retry_on=(OSError,), fresh_ttl=3600,
+                                         stale_ttl=86400)
+wikia_upstream = resilience.Upstream("wikia", deadline=10, retry_on=(OSError,), fresh_ttl=3600, stale_ttl=86400)
+
+
+class _TimeoutRequests(object):
+    """Stands in for requests in the wiki libraries, which make their requests without a timeout."""
+
+    __slots__ = ["timeout"]
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def get(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return requests.get(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+# Bounds every request, so the upstream's deadline bounds the work on its threads too
+wikipedia.wikipedia.requests = wikia.wikia.requests = _TimeoutRequests(timeout=5)
+
+
+def _first_image(page):
+    try:
+        return page.images[0]
+    except (IndexError, AttributeError):
+        return None
+
+
+def _wikipedia_article(query):
+    # Runs on an executor, since the page and its images are fetched lazily with blocking requests
+    page = wikipedia.page(query)
+    return page.title, page.url, wikipedia.summary(query, sentences=3), _first_image(page)
+
+
+def _wikia_article(wiki, query):
+    page = wikia.page(wiki, wikia.search(wiki, query)[0])
+    return page.title, page.url.replace(" ", "_"), page.summary, _first_image(page)
+
 
 @register("wiki")
 async def search(message):
     query = message.ai.get_parameter("search_query")
-    wiki = message.config["wiki"]
+    wiki = message.config.wiki
     if wiki is None or wiki.lower() == "wikipedia":
         try:
-            page = wikipedia.page(query)
-            summary = wikipedia.summary(query, sentences=3)
-            embed = Embed(title=page.title, url=page.url, description=summary, timestamp=datetime.utcnow())
-            try:
-                embed.set_thumbnail(url=page.images[0])
-            except (IndexError, AttributeError):
-                pass
-            suggestion = wikipedia.random()
+            title, url, summary, image = await wikipedia_upstream.run(query, _wikipedia_article, query)
+            embed = Embed(title=title, url=url, description=summary, timestamp=datetime.utcnow())
+            if image is not None:
+                embed.set_thumbnail(url=image)
+            suggestion = await wikipedia_upstream.run(None, wikipedia.random)
             embed.set_footer(text="Wikipedia | Try asking \"What is {}?\"".format(suggestion))
             await message.reply(embed=embed)
         except (ValueError, wikipedia.WikipediaException):
             await message.reply("Sorry, I have no information for your search query `{}`.".format(query))
+        except (resilience.DeadlineExceeded, OSError):
+            await message.reply("Sorry, Wikipedia isn't answering right now, please try again later.")
         return
     elif query is None:
         await message.reply("Sorry, I couldn't find a search query.", expire_time=5)
         return
     else:
         try:
-            results = wikia.search(wiki, query)
-            page = wikia.page(wiki, results[0])
-            url = page.url.replace(" ", "_")
-            embed = Embed(title=page.title, url=url, description=page.summary, timestamp=datetime.utcnow())
-            try:
-                embed.set_thumbnail(url=page.images[0])
-            except (IndexError, AttributeError):
-                pass
+            title, url, summary, image = await wikia_upstream.run((wiki, query), _wikia_article, wiki, query)
+            embed = Embed(title=title, url=url, description=summary, timestamp=datetime.utcnow())
+            if image is not None:
+                embed.set_thumbnail(url=image)
             embed.set_footer(text="{} wikia".format(wiki))
             await message.reply(embed=embed)
         except (ValueError, wikia.wikia.WikiaError):
             await message.reply("Sorry, I have no information for your search query `{}`.".format(query))
+        except (resilience.DeadlineExceeded, OSError):
+            await message.reply("Sorry, {} wikia isn't answering right now, please try again later.".format(wiki))
 
 
 # @register("define_word")
@@ -0,0 +1,115 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from .guildconfig import GuildConfig
+
+MAGIC = b"GLYS"
+VERSION = 1
+
+# Magic, format version, record count, watermark and CRC32 of everything after the header
+_header = struct.Struct("<4sHIdI")
+# Guild ID, updated at, data offset and data length, sorted by guild ID
+_entry = struct.Struct("<QdII")
+
+
+class ConfigSnapshot(object):
+    """A read-only, memory-mapped file of guild configs.
+
+    The file starts with a versioned and checksummed header, followed by an index sorted by guild ID and the JSON
+    encoded configs. Opening it only maps and verifies the file, single configs are decoded on lookup with a binary
+    search of the index.
+    """
+
+    __slots__ = ["path", "count", "watermark", "_file", "_map"]
+
+    def __init__(self, path, count, watermark, file, mapping):
+        self.path = path
+        self.count = count
+        self.watermark = watermark
+        self._file = file
+        self._map = mapping
+
+    @classmethod
+    def open(cls, path):
+        """Returns the snapshot at path, or None if it is missing, from another format version or corrupt."""
+        try:
+            file = open(path, "rb")
+        except OSError:
+            return None
+        try:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            file.close()
+            return None
+        try:
+            magic, version, count, watermark, checksum = _header.unpack_from(mapping, 0)
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC or version != VERSION or zlib.crc32(mapping[_header.size:]) != checksum:
+            mapping.close()
+            file.close()
+            return None
+        return cls(path, count, watermark, file, mapping)
+
+    @staticmethod
+    def encode(config):
+        return json.dumps(config.to_dict(), separators=(",", ":")).encode("utf-8")
+
+    @staticmethod
+    def write(path, records, watermark):
+        """Atomically writes (guild ID, updated at, encoded config) records to path."""
+        records = sorted(records, key=lambda record: record[0])
+        offset = _header.size + _entry.size * len(records)
+        index = bytearray()
+        for guild_id, updated_at, data in records:
+            index += _entry.pack(guild_id, updated_at, offset, len(data))
+            offset += len(data)
+        body = bytes(index) + b"".join(data for _, _, data in records)
+        temporary = "{}.tmp".format(path)
+        with open(temporary, "wb") as file:
+            file.write(_header.pack(MAGIC, VERSION, len(records), watermark, zlib.crc32(body)))
+            file.write(body)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+
+    def _read(self, position):
+        return _entry.unpack_from(self._map, _header.size + _entry.size * position)
+
+    def _decode(self, offset, length):
+        return GuildConfig.from_dict(json.loads(self._map[offset:offset + length].decode("utf-8")))
+
+    def __contains__(self, guild_id):
+        return self._find(int(guild_id)) is not None
+
+    def _find(self, guild_id):
+        low, high = 0, self.count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            entry = self._read(middle)
+            if entry[0] == guild_id:
+                return entry
+            if entry[0] < guild_id:
+                low = middle + 1
+            else:
+                high = middle - 1
+        return None
+
+    def get(self, guild_id):
+        entry = self._find(int(guild_id))
+        if entry is None:
+            return None
+        return self._decode(entry[2], entry[3])
+
+    def records(self):
+        """Yields the (guild ID, updated at, encoded config) records, which write takes back without decoding them."""
+        for position in range(self.count):
+            guild_id, updated_at, offset, length = self._read(position)
+            yield guild_id, updated_at, self._map[offset:offset + length]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
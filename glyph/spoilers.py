@@ -0,0 +1,71 @@
+from collections import deque
+
+
+def _is_word(char):
+    return char.isalnum() or char in "_'"
+
+
+class KeywordMatcher(object):
+    """An Aho-Corasick automaton over a guild's spoiler keywords.
+
+    Keywords may be phrases of several words and only match on whole words, case insensitively. Matching is a single
+    pass over the message no matter how many keywords there are.
+    """
+
+    __slots__ = ["keywords", "_goto", "_fail", "_output"]
+
+    def __init__(self, keywords):
+        self.keywords = self.normalize(keywords)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [0]  # Length of the longest keyword ending at each state, 0 for none
+        for keyword in self.keywords:
+            state = 0
+            for char in keyword:
+                following = self._goto[state].get(char)
+                if following is None:
+                    following = len(self._goto)
+                    self._goto[state][char] = following
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(0)
+                state = following
+            self._output[state] = len(keyword)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(char, 0)
+
+    @staticmethod
+    def normalize(keywords):
+        return frozenset(" ".join(keyword.lower().split()) for keyword in keywords or [] if keyword.strip())
+
+    def __bool__(self):
+        return bool(self.keywords)
+
+    def search(self, text):
+        """Returns the first keyword found in text, or None."""
+        if not self.keywords:
+            return None
+        goto, fail, output = self._goto, self._fail, self._output
+        text = " ".join(text.lower().split())
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            candidate = state
+            while candidate:
+                length = output[candidate]
+                if length:
+                    start = index - length + 1
+                    if (start == 0 or not _is_word(text[start - 1])) and \
+                            (index + 1 == len(text) or not _is_word(text[index + 1])):
+                        return text[start:index + 1]
+                candidate = fail[candidate]
+        return None
@@ -0,0 +1,74 @@
+import heapq
+
+
+class MemberStatistics(object):
+    """Keeps human and bot member counts for every server, updated incrementally from member and server events."""
+
+    __slots__ = ["servers", "humans", "bots"]
+
+    farm_percentage = 80
+    farm_minimum = 15
+
+    def __init__(self):
+        self.servers = {}  # Server ID to [humans, bots]
+        self.humans = 0
+        self.bots = 0
+
+    def seed(self, servers):
+        self.servers.clear()
+        self.humans = 0
+        self.bots = 0
+        for server in servers:
+            self.add_server(server)
+
+    def add_server(self, server):
+        self.remove_server(server)
+        bots = sum(1 for member in server.members if member.bot)
+        humans = len(server.members) - bots
+        self.servers[server.id] = [humans, bots]
+        self.humans += humans
+        self.bots += bots
+
+    def remove_server(self, server):
+        counts = self.servers.pop(server.id, None)
+        if counts is not None:
+            self.humans -= counts[0]
+            self.bots -= counts[1]
+
+    def member_joined(self, member):
+        self._change(member, 1)
+
+    def member_left(self, member):
+        self._change(member, -1)
+
+    def _change(self, member, delta):
+        counts = self.servers.get(member.server.id)
+        if counts is None:
+            return
+        if member.bot:
+            counts[1] += delta
+            self.bots += delta
+        else:
+            counts[0] += delta
+            self.humans += delta
+
+    @property
+    def total_members(self):
+        return self.humans + self.bots
+
+    def get(self, server):
+        """Returns the total, human and bot member counts of a server."""
+        humans, bots = self.servers.get(server.id, (0, 0))
+        return humans + bots, humans, bots
+
+    def busiest(self, count):
+        """Returns the IDs of the servers with the most members."""
+        return heapq.nlargest(count, self.servers, key=lambda server_id: sum(self.servers[server_id]))
+
+    def bot_percentage(self, server):
+        total, humans, bots = self.get(server)
+        return round(bots / (total or 1) * 100, 2)
+
+    def is_farm(self, server):
+        total, humans, bots = self.get(server)
+        return self.bot_percentage(server) > self.farm_percentage and total > self.farm_minimum
@@ -0,0 +1,88 @@
+import asyncio
+import json
+from os import environ
+
+import aiohttp
+
+# aiohttp 1.x raises disconnects outside of the ClientError hierarchy
+_transport_errors = (aiohttp.ClientError, OSError) + tuple(
+    error for error in [getattr(getattr(aiohttp, "errors", None), "DisconnectedError", None)] if error is not None)
+
+
+class WebError(Exception):
+
+    def __init__(self, message, *, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class WebClient(object):
+    """A shared, pooled HTTP client for every outbound integration.
+
+    The underlying session is created lazily so it binds to the running event loop, and connections are kept alive
+    between requests. Every request is bounded by a timeout and raises WebError on failure.
+    """
+
+    __slots__ = ["timeout", "limit", "limit_per_host", "keepalive_timeout", "_session", "_semaphore"]
+
+    def __init__(self, *, timeout=10, limit=100, limit_per_host=10, keepalive_timeout=30):
+        self.timeout = timeout
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+        self._semaphore = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            try:
+                connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                                 keepalive_timeout=self.keepalive_timeout)
+            except TypeError:  # aiohttp 1.x only knows a per host limit, the semaphore caps the total
+                connector = aiohttp.TCPConnector(limit=self.limit_per_host, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._session
+
+    async def request(self, method, url, *, timeout=None, **kwargs):
+        session = self.session
+        async with self._semaphore:
+            try:
+                return await asyncio.wait_for(self._fetch(session, method, url, **kwargs), timeout or self.timeout)
+            except asyncio.TimeoutError:
+                raise WebError("{} {} timed out".format(method, url))
+            except _transport_errors as e:
+                raise WebError("{} {} failed: {}".format(method, url, e)) from e
+
+    @staticmethod
+    async def _fetch(session, method, url, **kwargs):
+        async with session.request(method, url, **kwargs) as response:
+            return response.status, await response.text()
+
+    async def get_text(self, url, **kwargs):
+        status, text = await self.request("GET", url, **kwargs)
+        if status >= 400:
+            raise WebError("GET {} returned {}".format(url, status), status=status)
+        return text
+
+    async def get_json(self, url, **kwargs):
+        return json.loads(await self.get_text(url, **kwargs))
+
+    async def post(self, url, *, data=None, json_data=None, headers=None, **kwargs):
+        if json_data is not None:
+            data = json.dumps(json_data)
+            headers = dict(headers or {}, **{"Content-Type": "application/json"})
+        if headers is not None:
+            headers = {key: value for key, value in headers.items() if value is not None}
+        return await self.request("POST", url, data=data, headers=headers, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+client = WebClient(timeout=float(environ.get("HTTP_TIMEOUT", 10)),
+                   limit=int(environ.get("HTTP_POOL_LIMIT", 100)),
+                   limit_per_host=int(environ.get("HTTP_POOL_LIMIT_PER_HOST", 10)))